@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Compares an embedding backend against the fp32 PyTorch reference: cosine
+agreement of the vectors, top-k retrieval agreement, and throughput. Also
+estimates what re-ingesting the collection with the candidate would cost.
+
+Usage:
+    python benchmark_embeddings.py --backend torch-int8
+    python benchmark_embeddings.py --backend onnx --sample-chunks 500
+"""
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+
+from config import EMBEDDING_BATCH_SIZE
+from rag_models import EMBEDDING_BACKENDS, load_sentence_transformer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Below this minimum cosine agreement, stored fp32 vectors should be re-embedded
+REINGEST_COSINE_THRESHOLD = 0.99
+
+SAMPLE_TEXTS = [
+    "MongoDB announced new AI capabilities for Atlas Vector Search.",
+    "Total revenue was up year over year, driven by Atlas consumption growth.",
+    "The company expects revenue for the full fiscal year in the range provided in guidance.",
+    "Atlas revenue now represents the majority of total revenue.",
+    "We ended the quarter with more customers than a year ago.",
+    "Operating cash flow and free cash flow improved compared to the prior year period.",
+    "What are MongoDB's latest AI announcements?",
+    "How did Atlas grow this quarter?",
+]
+
+def load_texts(sample_chunks=0):
+    """Returns stored chunk texts sampled from the collection, or the built-in samples."""
+    if not sample_chunks:
+        return SAMPLE_TEXTS * 16
+    from db_utils import close_mongo_client, get_mongo_collection
+    try:
+        collection = get_mongo_collection("search")
+        return [doc["text"] for doc in collection.aggregate([{"$sample": {"size": sample_chunks}}, {"$project": {"text": 1}}])]
+    finally:
+        close_mongo_client()
+
+def encode(model, texts, batch_size):
+    """Encodes texts and returns (L2-normalized float32 vectors, chunks per second)."""
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    start = time.perf_counter()
+    vectors = np.asarray(model.encode(texts, batch_size=batch_size), dtype=np.float32)
+    throughput = len(texts) / (time.perf_counter() - start)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, throughput
+
+def top_k_agreement(reference, candidate, k):
+    """Mean overlap of each text's top-k neighbours under the two sets of vectors."""
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+    ref_top = np.argsort(-(reference @ reference.T), axis=1)[:, 1:k + 1]
+    cand_top = np.argsort(-(candidate @ candidate.T), axis=1)[:, 1:k + 1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]))
+
+def collection_size():
+    """Number of stored chunks, or None if the collection is unreachable."""
+    try:
+        from db_utils import close_mongo_client, get_mongo_collection
+        try:
+            return get_mongo_collection("search").estimated_document_count()
+        finally:
+            close_mongo_client()
+    except Exception as e:
+        logger.warning(f"Could not count stored chunks: {e}")
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=[b for b in EMBEDDING_BACKENDS if b != "torch"], required=True)
+    parser.add_argument("--sample-chunks", type=int, default=0, help="use N random stored chunks instead of built-in samples")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--k", type=int, default=3, help="neighbours compared for retrieval agreement")
+    args = parser.parse_args(argv)
+
+    texts = load_texts(args.sample_chunks)
+    logger.info(f"Encoding {len(texts)} texts with torch (fp32) and {args.backend}...")
+    reference, reference_throughput = encode(load_sentence_transformer("torch"), texts, args.batch_size)
+    candidate, candidate_throughput = encode(load_sentence_transformer(args.backend), texts, args.batch_size)
+
+    cosines = np.sum(reference * candidate, axis=1)
+    print(f"\nCosine agreement with fp32: mean {cosines.mean():.5f}, min {cosines.min():.5f}, p5 {np.percentile(cosines, 5):.5f}")
+    print(f"Top-{args.k} neighbour agreement: {top_k_agreement(reference, candidate, args.k):.3f}")
+    print(f"Throughput: torch {reference_throughput:.1f} chunks/s, {args.backend} {candidate_throughput:.1f} chunks/s "
+          f"({candidate_throughput / reference_throughput:.2f}x)")
+
+    if cosines.min() >= REINGEST_COSINE_THRESHOLD:
+        print(f"Vectors agree to >= {REINGEST_COSINE_THRESHOLD}; {args.backend} can serve queries against the existing corpus.")
+    else:
+        count = collection_size()
+        estimate = f"~{count / candidate_throughput / 60:.1f} min of embedding for {count} chunks" if count else "unknown (collection unreachable)"
+        print(f"Vectors diverge below {REINGEST_COSINE_THRESHOLD}; re-ingest before switching. Estimated cost: {estimate}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
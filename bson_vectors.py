@@ -0,0 +1,43 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/bson_vectors.py
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype, VECTOR_SUBTYPE
+
+from config import EMBEDDING_STORAGE
+
+VECTOR_STORAGE_TYPES = ("float32", "int8")
+
+# int8 codes span +/- this many times the RMS component of a unit vector
+INT8_CLIP_SIGMAS = 4.0
+
+def int8_scale(dimensions):
+    """Value of one int8 step for unit vectors of the given size; fixed, so dot products stay comparable."""
+    return INT8_CLIP_SIGMAS / np.sqrt(dimensions) / 127
+
+def quantize_int8(vectors):
+    """Scalar-quantizes unit vectors (one per row) to int8 codes."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return np.clip(np.rint(vectors / int8_scale(vectors.shape[-1])), -127, 127).astype(np.int8)
+
+def encode_vector(vector, storage=EMBEDDING_STORAGE):
+    """
+    Packs a unit vector into a BSON binary vector (subtype 9): float32, or
+    int8 codes when storage is 'int8'. The payload is copied from the NumPy
+    buffer in one go, with no per-element Python objects.
+    """
+    if storage == "int8":
+        return Binary(BinaryVectorDtype.INT8.value + b"\x00" + quantize_int8(vector).tobytes(), VECTOR_SUBTYPE)
+    if storage == "float32":
+        return Binary(BinaryVectorDtype.FLOAT32.value + b"\x00" + np.asarray(vector, dtype="<f4").tobytes(), VECTOR_SUBTYPE)
+    raise ValueError(f"Unknown vector storage '{storage}', expected one of {VECTOR_STORAGE_TYPES}")
+
+def decode_vector(value):
+    """Returns a stored embedding as a float32 array: binary vectors (int8 dequantized) or legacy arrays of doubles."""
+    if isinstance(value, Binary) and value.subtype == VECTOR_SUBTYPE:
+        dtype = value[:1]
+        if dtype == BinaryVectorDtype.FLOAT32.value:
+            return np.frombuffer(value, dtype="<f4", offset=2)
+        if dtype == BinaryVectorDtype.INT8.value:
+            codes = np.frombuffer(value, dtype=np.int8, offset=2)
+            return codes.astype(np.float32) * int8_scale(len(codes))
+        raise ValueError(f"Unsupported binary vector dtype {dtype!r}")
+    return np.asarray(value, dtype=np.float32)
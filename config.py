@@ -43,14 +43,163 @@ else:
 DB_NAME = "rag_db"
 COLLECTION_NAME = "test"
 VECTOR_SEARCH_INDEX_NAME = "vector_index"
+TEXT_SEARCH_INDEX_NAME = "text_index"
+# How long provisioning waits for the index to become ready, and how long a
+# cached index status is trusted by /health
+VECTOR_INDEX_READY_TIMEOUT_SECONDS = float(os.getenv("VECTOR_INDEX_READY_TIMEOUT_SECONDS", "600"))
+VECTOR_INDEX_STATUS_MAX_AGE_SECONDS = float(os.getenv("VECTOR_INDEX_STATUS_MAX_AGE_SECONDS", "30"))
+
+# Background ingestion jobs: status documents, the per-collection lease that
+# allows one ingestion at a time, and how often progress is persisted
+INGEST_JOBS_COLLECTION = "ingest_jobs"
+INGEST_LOCKS_COLLECTION = "ingest_locks"
+INGEST_LOCK_TTL_SECONDS = int(os.getenv("INGEST_LOCK_TTL_SECONDS", "120"))
+INGEST_JOB_UPDATE_SECONDS = float(os.getenv("INGEST_JOB_UPDATE_SECONDS", "2"))
+
+# --- Retrieval Configuration ---
+# "ann" uses approximate HNSW search over VECTOR_SEARCH_NUM_CANDIDATES neighbours;
+# "exact" scans every vector (use for evaluation, see evaluate_retrieval.py)
+VECTOR_SEARCH_MODE = os.getenv("VECTOR_SEARCH_MODE", "ann").lower()
+VECTOR_SEARCH_LIMIT = int(os.getenv("VECTOR_SEARCH_LIMIT", "3"))
+VECTOR_SEARCH_NUM_CANDIDATES = int(os.getenv("VECTOR_SEARCH_NUM_CANDIDATES", "100"))
+
+# "atlas" runs $vectorSearch on the cluster; "local" answers from an in-process
+# NumPy snapshot of the collection (build it with `python local_vector_store.py`)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "atlas").lower()
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "/tmp/cache/local_index")
+LOCAL_INDEX_CHECK_INTERVAL_SECONDS = float(os.getenv("LOCAL_INDEX_CHECK_INTERVAL_SECONDS", "30"))
+
+# "hybrid" runs a full-text search alongside the vector search and merges the
+# two rankings with weighted reciprocal rank fusion (score = weight / (k + rank)).
+# The full-text leg uses an Atlas Search index, or BM25 over the local snapshot.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+TEXT_SEARCH_BACKEND = os.getenv("TEXT_SEARCH_BACKEND", RETRIEVAL_BACKEND).lower()
+HYBRID_VECTOR_LIMIT = int(os.getenv("HYBRID_VECTOR_LIMIT", "10"))
+HYBRID_TEXT_LIMIT = int(os.getenv("HYBRID_TEXT_LIMIT", "10"))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", "1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# Optional cross-encoder reranking: retrieve RERANK_CANDIDATES chunks, score
+# them against the query in one batch and keep the best RERANK_TOP_K. Skipped
+# when retrieval alone took longer than RERANK_LATENCY_BUDGET_MS.
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", str(VECTOR_SEARCH_LIMIT)))
+RERANK_LATENCY_BUDGET_MS = float(os.getenv("RERANK_LATENCY_BUDGET_MS", "500"))
+RERANK_SCORE_CACHE_SIZE = int(os.getenv("RERANK_SCORE_CACHE_SIZE", "8192"))
+RERANK_SCORE_CACHE_TTL_SECONDS = float(os.getenv("RERANK_SCORE_CACHE_TTL_SECONDS", "3600"))
+
+# Context chunks are picked by maximal marginal relevance from MMR_FETCH_K
+# candidates; a chunk whose cosine similarity to an already selected one reaches
+# the threshold is dropped. MMR_LAMBDA weighs relevance against novelty (1.0 =
+# relevance only).
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.9"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", str(4 * VECTOR_SEARCH_LIMIT)))
+
+# --- MongoDB Connection Pool ---
+# One MongoClient is shared per process; these control its pool and the
+# per-path read/write settings (search = retrieval, ingest = document loading).
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+SEARCH_READ_PREFERENCE = os.getenv("SEARCH_READ_PREFERENCE", "secondaryPreferred")
+SEARCH_WRITE_CONCERN = os.getenv("SEARCH_WRITE_CONCERN", "1")
+INGEST_READ_PREFERENCE = os.getenv("INGEST_READ_PREFERENCE", "primary")
+INGEST_WRITE_CONCERN = os.getenv("INGEST_WRITE_CONCERN", "majority")
+
+# --- Embedding Model Configuration ---
+EMBEDDING_MODEL_NAME = "nomic-ai/nomic-embed-text-v1"
+# Pin a model revision so cached and stored vectors stay comparable
+EMBEDDING_MODEL_REVISION = os.getenv("EMBEDDING_MODEL_REVISION") or None
+# CPU inference backend: "torch" (fp32), "torch-int8" (dynamic quantization) or
+# "onnx" (ONNX Runtime). Check parity with benchmark_embeddings.py before switching.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quantized.onnx")
+
+# Dimensionality of stored and query vectors; the model itself produces 768.
+# "pca" projects onto components fitted on the corpus at ingestion time,
+# "truncate" keeps the leading components. Compare settings with evaluate_dimensions.py.
+EMBEDDING_MODEL_DIMENSIONS = 768
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", str(EMBEDDING_MODEL_DIMENSIONS)))
+EMBEDDING_REDUCTION = os.getenv("EMBEDDING_REDUCTION", "pca").lower()
+EMBEDDING_PROJECTION_FIT_SAMPLES = int(os.getenv("EMBEDDING_PROJECTION_FIT_SAMPLES", "4096"))
+EMBEDDING_PROJECTIONS_COLLECTION = "embedding_projections"
+# Stored vectors are packed BSON binary vectors of unit length (dotProduct index):
+# "float32", or "int8" for scalar-quantized vectors a quarter of the size
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32").lower()
+
+# Persistent embedding cache shared by all workers on the host
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/cache/embeddings.sqlite")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# In-memory LRU of query embeddings for the retrieval path (0 disables)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+
+# Threads running CPU-bound embedding for the async request path
+EMBEDDING_EXECUTOR_WORKERS = int(os.getenv("EMBEDDING_EXECUTOR_WORKERS", "2"))
+
+# Micro-batching of concurrent single-text embedding requests: wait up to
+# EMBEDDING_BATCH_WINDOW_MS for more requests (0 disables), at most
+# EMBEDDING_MAX_BATCH_SIZE texts per encode
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
 
 # --- LLM Configuration ---
 # Using Hugging Face's Mistral model
 HF_MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
 
-# PDF URL for initial ingestion
+# Semantic answer cache: reuse an earlier answer when a new query's embedding
+# is at least this cosine-similar to a cached one (size 0 disables). Questions
+# that differ only in a quarter or year embed very closely, so keep it high.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.985"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "900"))
+# Corpus version stamp bumped by ingestion and /cache/invalidate; every worker
+# polls it this often and drops its cached answers when it changes
+CORPUS_VERSIONS_COLLECTION = "corpus_versions"
+ANSWER_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("ANSWER_CACHE_VERSION_CHECK_SECONDS", "5"))
+
+# Batch questions (/ask/batch): max queries per request and concurrent LLM calls
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+# PDF URL for initial ingestion, and the source name its chunks are stored under
 INVESTOR_PDF_URL = "https://investors.mongodb.com/node/12236/pdf"
+INVESTOR_PDF_SOURCE = "MongoDB Investor Relations PDF"
+
+# Multi-document ingestion: optional JSON manifest of documents to ingest
+# (default: the investor PDF alone), and how many documents are processed at once
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH") or None
+INGEST_DOCUMENT_CONCURRENCY = int(os.getenv("INGEST_DOCUMENT_CONCURRENCY", "4"))
 
 # Chunking parameters
 CHUNK_SIZE = 400
 CHUNK_OVERLAP = 20
+
+# Embedding batch size used during ingestion (chunks per model forward pass)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# Streaming ingestion: max batches buffered between pipeline stages, and
+# per-batch write retries with exponential backoff
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+# Total write attempts per batch, including the first
+INGEST_WRITE_RETRIES = int(os.getenv("INGEST_WRITE_RETRIES", "3"))
+if INGEST_WRITE_RETRIES < 1:
+    raise ValueError(f"INGEST_WRITE_RETRIES must be at least 1, got {INGEST_WRITE_RETRIES}")
+INGEST_RETRY_BACKOFF_SECONDS = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", "1.0"))
+
+# PDF text extraction: worker processes shared by all ingestion pipelines
+# (1 extracts pages in the ingesting thread) and pages per worker task
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARSE_PAGES_PER_TASK = int(os.getenv("PDF_PARSE_PAGES_PER_TASK", "8"))
+
+# Startup budgets checked by measure_cold_start.py: time to import the app,
+# and time from import until the models are loaded and warmed up
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "3"))
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "60"))
@@ -1,247 +1,1100 @@
 # RAG WITH ATLAS VECTOR SEARCH/backend/db_utils.py
-from pymongo import MongoClient
-from pymongo.operations import SearchIndexModel
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pymongo import AsyncMongoClient, MongoClient, ReadPreference, WriteConcern
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.operations import ReplaceOne, SearchIndexModel
 from config import MONGO_URI, DB_NAME, COLLECTION_NAME, VECTOR_SEARCH_INDEX_NAME, INVESTOR_PDF_URL, CHUNK_SIZE, CHUNK_OVERLAP
-from rag_models import get_embedding
+from config import INVESTOR_PDF_SOURCE, INGEST_MANIFEST_PATH, INGEST_DOCUMENT_CONCURRENCY
+from config import (
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    SEARCH_READ_PREFERENCE, SEARCH_WRITE_CONCERN, INGEST_READ_PREFERENCE, INGEST_WRITE_CONCERN,
+    EMBEDDING_BATCH_SIZE, INGEST_QUEUE_SIZE, INGEST_WRITE_RETRIES, INGEST_RETRY_BACKOFF_SECONDS,
+    VECTOR_SEARCH_MODE, VECTOR_SEARCH_LIMIT, VECTOR_SEARCH_NUM_CANDIDATES, RETRIEVAL_BACKEND,
+    VECTOR_INDEX_READY_TIMEOUT_SECONDS, VECTOR_INDEX_STATUS_MAX_AGE_SECONDS,
+    EMBEDDING_DIMENSIONS, EMBEDDING_PROJECTION_FIT_SAMPLES, EMBEDDING_STORAGE,
+    TEXT_SEARCH_INDEX_NAME, RETRIEVAL_MODE, TEXT_SEARCH_BACKEND, HYBRID_VECTOR_LIMIT, HYBRID_TEXT_LIMIT,
+    HYBRID_VECTOR_WEIGHT, HYBRID_TEXT_WEIGHT, HYBRID_RRF_K
+)
+from rag_models import get_embeddings, get_ingest_embeddings, get_query_embedding, aget_query_embedding
+from embedding_projection import (
+    EmbeddingProjection, ProjectionNotFitted, get_embedding_projection, save_embedding_projection,
+    project_query_embedding, reduction_enabled, current_projection_id, aget_embedding_projection,
+    aproject_query_embedding
+)
+from semantic_cache import invalidate_answer_cache
+from bson_vectors import encode_vector
+from local_vector_store import build_snapshot, get_local_vector_store, reload_local_vector_store
+from pdf_parsing import iter_pdf_pages, close_pdf_parse_pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import posixpath
+import queue
+import threading
 import time
+import urllib.parse
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_mongo_collection():
-    """Establishes MongoDB connection and returns the collection. MONGO_URI is loaded from environment for security."""
-    import urllib.parse
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+_async_mongo_client = None
+_async_mongo_client_lock = None
 
-    # Ensure the MongoDB URI is properly encoded
-    if MONGO_URI:
-        logger.info(f"Raw MONGO_URI from config: {MONGO_URI[:50]}...")
-        try:
-            # More robust encoding logic
-            if 'mongodb+srv://' in MONGO_URI or 'mongodb://' in MONGO_URI:
-                # Parse the URI more carefully
-                if 'mongodb+srv://' in MONGO_URI:
-                    scheme, rest = MONGO_URI.split('://', 1)
-                else:
-                    scheme, rest = MONGO_URI.split('://', 1)
-
-                if '@' in rest:
-                    auth_part, host_part = rest.split('@', 1)
-                    if ':' in auth_part:
-                        username, password = auth_part.split(':', 1)
-                        # URL encode username and password with more aggressive encoding
-                        encoded_username = urllib.parse.quote_plus(username, safe='')
-                        encoded_password = urllib.parse.quote_plus(password, safe='')
-                        # Reconstruct the URI
-                        encoded_uri = f"{scheme}://{encoded_username}:{encoded_password}@{host_part}"
-                        logger.info(f"Encoded URI: {encoded_uri[:50]}...")
-                    else:
-                        encoded_uri = MONGO_URI
-                        logger.info("No password found in URI")
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+# Read/write settings applied per access path on top of the shared client
+_COLLECTION_SETTINGS = {
+    "search": (SEARCH_READ_PREFERENCE, SEARCH_WRITE_CONCERN),
+    "ingest": (INGEST_READ_PREFERENCE, INGEST_WRITE_CONCERN),
+}
+
+def _encode_mongo_uri(uri):
+    """URL-encodes the username and password of a MongoDB URI."""
+    logger.info(f"Raw MONGO_URI from config: {uri[:50]}...")
+    try:
+        # More robust encoding logic
+        if 'mongodb+srv://' in uri or 'mongodb://' in uri:
+            scheme, rest = uri.split('://', 1)
+
+            if '@' in rest:
+                auth_part, host_part = rest.split('@', 1)
+                if ':' in auth_part:
+                    username, password = auth_part.split(':', 1)
+                    # URL encode username and password with more aggressive encoding
+                    encoded_username = urllib.parse.quote_plus(username, safe='')
+                    encoded_password = urllib.parse.quote_plus(password, safe='')
+                    # Reconstruct the URI
+                    encoded_uri = f"{scheme}://{encoded_username}:{encoded_password}@{host_part}"
+                    logger.info(f"Encoded URI: {encoded_uri[:50]}...")
                 else:
-                    encoded_uri = MONGO_URI
-                    logger.info("No authentication found in URI")
+                    encoded_uri = uri
+                    logger.info("No password found in URI")
             else:
-                encoded_uri = MONGO_URI
-                logger.info("Not a MongoDB URI")
-        except Exception as e:
-            logger.error(f"Error encoding MongoDB URI: {e}")
-            encoded_uri = MONGO_URI
-    else:
-        raise ValueError("MONGO_URI is not set")
+                encoded_uri = uri
+                logger.info("No authentication found in URI")
+        else:
+            encoded_uri = uri
+            logger.info("Not a MongoDB URI")
+    except Exception as e:
+        logger.error(f"Error encoding MongoDB URI: {e}")
+        encoded_uri = uri
+    return encoded_uri
 
-    logger.info(f"Final URI for connection: {encoded_uri[:50]}...")
+def _parse_write_concern(value):
+    """Builds a WriteConcern from a config value such as 'majority' or '1'."""
+    value = str(value)
+    return WriteConcern(w=int(value) if value.isdigit() else value)
 
-    try:
+def _pool_options():
+    """Connection pool and timeout options shared by the sync and async clients."""
+    return dict(
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=30000,
+        socketTimeoutMS=30000,
+        retryWrites=True
+    )
+
+def _connection_attempts(encoded_uri):
+    """Ordered (description, uri, extra options) to try, falling back through relaxed SSL settings."""
+    # Remove SSL parameters from URI if present for the last resort
+    uri_without_ssl = encoded_uri.replace("?ssl=true", "").replace("&ssl=true", "")
+    return [
         # Try with minimal SSL configuration first
-        client = MongoClient(
-            encoded_uri,
-            serverSelectionTimeoutMS=30000,
-            connectTimeoutMS=30000,
-            socketTimeoutMS=30000,
-            retryWrites=True,
-            w='majority'
-        )
-        client.admin.command('ping')
-        collection = client[DB_NAME][COLLECTION_NAME]
-        logger.info("Successfully connected to MongoDB Atlas.")
-        return collection
-    except Exception as e:
-        logger.error(f"Error connecting to MongoDB Atlas: {e}")
+        ("", encoded_uri, {}),
         # If the first attempt fails, try with explicit SSL configuration
+        (" with relaxed SSL", encoded_uri, dict(tls=True, tlsAllowInvalidCertificates=True, tlsAllowInvalidHostnames=True)),
+        # Try with Render-specific SSL bypass
+        (" with Render SSL bypass", encoded_uri, dict(tls=True, tlsInsecure=True)),
+        # Try with no SSL configuration as last resort
+        (" without SSL", uri_without_ssl, {}),
+    ]
+
+def _create_mongo_client(encoded_uri):
+    """Creates a pooled MongoClient, falling back through relaxed SSL settings."""
+    attempts = _connection_attempts(encoded_uri)
+    for i, (description, uri, options) in enumerate(attempts):
+        if i:
+            logger.info(f"Retrying{description}...")
+        client = MongoClient(uri, **options, **_pool_options())
         try:
-            logger.info("Retrying with explicit SSL configuration...")
-            client = MongoClient(
-                encoded_uri,
-                serverSelectionTimeoutMS=30000,
-                connectTimeoutMS=30000,
-                socketTimeoutMS=30000,
-                tls=True,
-                tlsAllowInvalidCertificates=True,
-                tlsAllowInvalidHostnames=True,
-                retryWrites=True,
-                w='majority'
-            )
             client.admin.command('ping')
-            collection = client[DB_NAME][COLLECTION_NAME]
-            logger.info("Successfully connected to MongoDB Atlas with relaxed SSL.")
-            return collection
-        except Exception as e2:
-            logger.error(f"Error connecting to MongoDB Atlas with relaxed SSL: {e2}")
-            # Try with Render-specific SSL bypass
-            try:
-                logger.info("Retrying with Render-specific SSL bypass...")
-                client = MongoClient(
-                    encoded_uri,
-                    serverSelectionTimeoutMS=30000,
-                    connectTimeoutMS=30000,
-                    socketTimeoutMS=30000,
-                    tls=True,
-                    tlsInsecure=True,
-                    retryWrites=True,
-                    w='majority'
-                )
-                client.admin.command('ping')
-                collection = client[DB_NAME][COLLECTION_NAME]
-                logger.info("Successfully connected to MongoDB Atlas with Render SSL bypass.")
-                return collection
-            except Exception as e3:
-                logger.error(f"Error connecting to MongoDB Atlas with Render SSL bypass: {e3}")
-                # Try with no SSL configuration as last resort
-                try:
-                    logger.info("Retrying without SSL configuration...")
-                    # Remove SSL parameters from URI if present
-                    uri_without_ssl = encoded_uri.replace("?ssl=true", "").replace("&ssl=true", "")
-                    client = MongoClient(
-                        uri_without_ssl,
-                        serverSelectionTimeoutMS=30000,
-                        connectTimeoutMS=30000,
-                        socketTimeoutMS=30000,
-                        retryWrites=True,
-                        w='majority'
-                    )
-                    client.admin.command('ping')
-                    collection = client[DB_NAME][COLLECTION_NAME]
-                    logger.info("Successfully connected to MongoDB Atlas without SSL.")
-                    return collection
-                except Exception as e4:
-                    logger.error(f"Error connecting to MongoDB Atlas without SSL: {e4}")
-                    raise
-
-def create_vector_search_index(collection):
-    """Creates the vector search index (from notebook)."""
-    index_name = VECTOR_SEARCH_INDEX_NAME
-    search_index_model = SearchIndexModel(
-        definition={
-            "fields": [
-                {
-                    "type": "vector",
-                    "numDimensions": 768,
-                    "path": "embedding",
-                    "similarity": "cosine"
-                }
-            ]
-        },
-        name=index_name,
-        type="vectorSearch"
+            logger.info(f"Successfully connected to MongoDB Atlas{description}.")
+            return client
+        except Exception as e:
+            logger.error(f"Error connecting to MongoDB Atlas{description}: {e}")
+            client.close()
+            if i == len(attempts) - 1:
+                raise
+
+async def _create_async_mongo_client(encoded_uri):
+    """Creates a pooled AsyncMongoClient, falling back through relaxed SSL settings."""
+    attempts = _connection_attempts(encoded_uri)
+    for i, (description, uri, options) in enumerate(attempts):
+        if i:
+            logger.info(f"Retrying async client{description}...")
+        client = AsyncMongoClient(uri, **options, **_pool_options())
+        try:
+            await client.admin.command('ping')
+            logger.info(f"Async client connected to MongoDB Atlas{description}.")
+            return client
+        except Exception as e:
+            logger.error(f"Error connecting async client to MongoDB Atlas{description}: {e}")
+            await client.close()
+            if i == len(attempts) - 1:
+                raise
+
+def get_mongo_client():
+    """Returns the process-wide MongoClient, connecting on first use. MONGO_URI is loaded from environment for security."""
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                if not MONGO_URI:
+                    raise ValueError("MONGO_URI is not set")
+                encoded_uri = _encode_mongo_uri(MONGO_URI)
+                logger.info(f"Final URI for connection: {encoded_uri[:50]}...")
+                _mongo_client = _create_mongo_client(encoded_uri)
+    return _mongo_client
+
+def close_mongo_client():
+    """Closes the shared MongoClient and its connection pool."""
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+            logger.info("Closed MongoDB client.")
+
+def get_mongo_collection(purpose: str = "search"):
+    """
+    Returns the collection from the shared client, configured with the read
+    preference and write concern for the given purpose ('search' or 'ingest').
+    """
+    read_preference, write_concern = _COLLECTION_SETTINGS[purpose]
+    return get_mongo_client()[DB_NAME].get_collection(
+        COLLECTION_NAME,
+        read_preference=_READ_PREFERENCES[read_preference],
+        write_concern=_parse_write_concern(write_concern)
     )
 
-    try:
-        collection.create_search_index(model=search_index_model)
-        logger.info(f"Created vector search index: {index_name}")
+def _get_async_client_lock():
+    """Lazily creates the lock guarding async client creation."""
+    global _async_mongo_client_lock
+    if _async_mongo_client_lock is None:
+        _async_mongo_client_lock = asyncio.Lock()
+    return _async_mongo_client_lock
 
-        # Wait for index to be ready
-        print("Polling to check if the index is ready. This may take up to a minute.")
-        predicate = lambda index: index.get("queryable") is True
+async def get_async_mongo_client():
+    """
+    Returns the process-wide AsyncMongoClient used by the async request path.
+    It is bound to the running event loop, so it is opened in the FastAPI lifespan.
+    """
+    global _async_mongo_client
+    if _async_mongo_client is None:
+        async with _get_async_client_lock():
+            if _async_mongo_client is None:
+                if not MONGO_URI:
+                    raise ValueError("MONGO_URI is not set")
+                _async_mongo_client = await _create_async_mongo_client(_encode_mongo_uri(MONGO_URI))
+    return _async_mongo_client
 
-        while True:
-            indices = list(collection.list_search_indexes(index_name))
-            if len(indices) and predicate(indices[0]):
-                break
-            time.sleep(5)
-        print(f"{index_name} is ready for querying.")
+async def close_async_mongo_client():
+    """Closes the shared AsyncMongoClient and its connection pool."""
+    global _async_mongo_client
+    if _async_mongo_client is not None:
+        await _async_mongo_client.close()
+        _async_mongo_client = None
+        logger.info("Closed async MongoDB client.")
 
-    except Exception as e:
-        logger.error(f"Error creating vector search index: {e}")
-        raise
+async def get_async_mongo_collection(purpose: str = "search"):
+    """Async counterpart of get_mongo_collection()."""
+    read_preference, write_concern = _COLLECTION_SETTINGS[purpose]
+    client = await get_async_mongo_client()
+    return client[DB_NAME].get_collection(
+        COLLECTION_NAME,
+        read_preference=_READ_PREFERENCES[read_preference],
+        write_concern=_parse_write_concern(write_concern)
+    )
+
+# Runs the full-text leg of hybrid retrieval while the query is embedded
+_text_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="text-search")
+
+_vector_index_status = {"status": "UNKNOWN", "queryable": False, "checked_at": 0.0}
+_vector_index_waiter = None
+
+def vector_search_index_definition():
+    """Returns the vector search index definition the code expects."""
+    return {
+        "fields": [
+            {
+                "type": "vector",
+                "numDimensions": EMBEDDING_DIMENSIONS,
+                "path": "embedding",
+                "similarity": "dotProduct"
+            },
+            # Metadata that searches can pre-filter on inside the index
+            {"type": "filter", "path": "source"},
+            {"type": "filter", "path": "url"},
+            {"type": "filter", "path": "page_number"},
+            {"type": "filter", "path": "pdf_page"},
+            {"type": "filter", "path": "ingested_at"},
+            # Searches only rank chunks stored in the current vector space and format
+            {"type": "filter", "path": "projection"},
+            {"type": "filter", "path": "vector_storage"}
+        ]
+    }
+
+def _same_index_definition(current, expected):
+    """Compares index definitions field by field, ignoring field order."""
+    def normalize(definition):
+        return sorted(json.dumps(field, sort_keys=True) for field in definition.get("fields", []))
+    return normalize(current) == normalize(expected)
+
+def _record_index_status(index):
+    """Caches the latest observed index status for get_vector_index_status()."""
+    _vector_index_status.update(
+        status=index.get("status", "READY" if index.get("queryable") else "PENDING") if index else "DOES_NOT_EXIST",
+        queryable=bool(index and index.get("queryable")),
+        checked_at=time.monotonic()
+    )
+    return _vector_index_status["status"]
 
-def ingest_documents_to_mongodb(pdf_url: str = INVESTOR_PDF_URL):
+def wait_for_vector_search_index(collection, timeout=VECTOR_INDEX_READY_TIMEOUT_SECONDS, initial_delay=1.0, max_delay=30.0,
+                                 cancel_event=None):
     """
-    Loads PDF, chunks it, generates embeddings, and stores in MongoDB Atlas (from notebook).
+    Polls until the index reports READY, backing off exponentially between
+    checks. Raises TimeoutError if it is not ready by the deadline,
+    RuntimeError if the build failed, and IngestionCancelled if cancel_event
+    is set while waiting.
     """
-    collection = get_mongo_collection()
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        indices = list(collection.list_search_indexes(VECTOR_SEARCH_INDEX_NAME))
+        status = _record_index_status(indices[0] if indices else None)
+        if status == "READY":
+            logger.info(f"{VECTOR_SEARCH_INDEX_NAME} is ready for querying.")
+            return
+        if status == "FAILED":
+            raise RuntimeError(f"Vector search index {VECTOR_SEARCH_INDEX_NAME} failed to build.")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Vector search index {VECTOR_SEARCH_INDEX_NAME} not ready after {timeout}s (status {status}).")
+        if cancel_event is None:
+            time.sleep(min(delay, remaining))
+        elif cancel_event.wait(min(delay, remaining)):
+            raise IngestionCancelled(f"Stopped waiting for {VECTOR_SEARCH_INDEX_NAME}: ingestion was cancelled.")
+        delay = min(delay * 2, max_delay)
 
-    logger.info(f"Loading PDF from {pdf_url}...")
+def _wait_for_index_in_background(collection, timeout):
+    """Starts (at most one) background thread that polls the index until it is ready."""
+    global _vector_index_waiter
+
+    def wait():
+        try:
+            wait_for_vector_search_index(collection, timeout)
+        except Exception as e:
+            logger.error(f"Error waiting for vector search index: {e}")
+
+    if _vector_index_waiter is None or not _vector_index_waiter.is_alive():
+        _vector_index_waiter = threading.Thread(target=wait, name="vector-index-waiter", daemon=True)
+        _vector_index_waiter.start()
+
+def ensure_vector_search_index(collection, wait=False, timeout=VECTOR_INDEX_READY_TIMEOUT_SECONDS, cancel_event=None):
+    """
+    Creates the vector search index if it is missing, updates it if its
+    definition has drifted (e.g. numDimensions or similarity), and otherwise
+    reuses it. With wait=False readiness is polled in the background and can be
+    read from get_vector_index_status(); with wait=True this blocks until the
+    index is ready, the timeout expires or cancel_event is set.
+    Returns 'created', 'updated' or 'unchanged'.
+    """
+    index_name = VECTOR_SEARCH_INDEX_NAME
+    definition = vector_search_index_definition()
     try:
-        loader = PyPDFLoader(pdf_url)
-        data = loader.load()
-        logger.info(f"Loaded {len(data)} pages from PDF.")
+        existing = list(collection.list_search_indexes(index_name))
+        if not existing:
+            collection.create_search_index(model=SearchIndexModel(definition=definition, name=index_name, type="vectorSearch"))
+            action = "created"
+        elif not _same_index_definition(existing[0].get("latestDefinition", {}), definition):
+            collection.update_search_index(index_name, definition)
+            action = "updated"
+        else:
+            action = "unchanged"
+        logger.info(f"Vector search index {index_name}: {action}.")
     except Exception as e:
-        logger.error(f"Error loading PDF from {pdf_url}: {e}")
+        logger.error(f"Error provisioning vector search index: {e}")
         raise
 
+    if action == "unchanged" and _record_index_status(existing[0]) == "READY":
+        return action
+    if wait:
+        wait_for_vector_search_index(collection, timeout, cancel_event=cancel_event)
+    else:
+        _wait_for_index_in_background(collection, timeout)
+    return action
+
+def text_search_index_definition():
+    """Atlas Search index over chunk text, used by hybrid retrieval."""
+    return {
+        "mappings": {
+            "dynamic": False,
+            "fields": {
+                "text": {"type": "string"},
+                "source": {"type": "token"},
+                "url": {"type": "token"},
+                "page_number": {"type": "token"},
+                "pdf_page": {"type": "number"},
+                "ingested_at": {"type": "date"},
+                "projection": {"type": "token"},
+                "vector_storage": {"type": "token"}
+            }
+        }
+    }
+
+def ensure_text_search_index(collection):
+    """
+    Creates the full-text index if it is missing or updates it if its mappings
+    changed. Does not wait: hybrid retrieval falls back to vector results
+    until the index is queryable. Returns 'created', 'updated' or 'unchanged'.
+    """
+    definition = text_search_index_definition()
+    existing = list(collection.list_search_indexes(TEXT_SEARCH_INDEX_NAME))
+    if not existing:
+        collection.create_search_index(model=SearchIndexModel(definition=definition, name=TEXT_SEARCH_INDEX_NAME, type="search"))
+        action = "created"
+    elif existing[0].get("latestDefinition", {}).get("mappings") != definition["mappings"]:
+        collection.update_search_index(TEXT_SEARCH_INDEX_NAME, definition)
+        action = "updated"
+    else:
+        action = "unchanged"
+    logger.info(f"Text search index {TEXT_SEARCH_INDEX_NAME}: {action}.")
+    return action
+
+def get_vector_index_status(max_age=VECTOR_INDEX_STATUS_MAX_AGE_SECONDS):
+    """
+    Returns the vector index status ('READY', 'BUILDING', 'PENDING',
+    'DOES_NOT_EXIST', ...) and whether it is queryable, refreshing the cached
+    value when it is older than max_age seconds.
+    """
+    if time.monotonic() - _vector_index_status["checked_at"] > max_age:
+        indices = list(get_mongo_collection("search").list_search_indexes(VECTOR_SEARCH_INDEX_NAME))
+        _record_index_status(indices[0] if indices else None)
+    return {"name": VECTOR_SEARCH_INDEX_NAME, "status": _vector_index_status["status"], "queryable": _vector_index_status["queryable"]}
+
+_STAGE_DONE = object()
+
+def _log_embedding_progress(done, total):
+    """Default ingestion progress callback."""
+    if total:
+        logger.info(f"Embedded {done}/{total} chunks.")
+    else:
+        logger.info(f"Embedded {done} chunks.")
+
+def default_source_name(url):
+    """Display name for a document without one: the URL's last path segment."""
+    if url == INVESTOR_PDF_URL:
+        return INVESTOR_PDF_SOURCE
+    path = urllib.parse.urlparse(url).path.rstrip("/")
+    return posixpath.basename(path) or url
+
+def normalize_manifest(sources):
+    """
+    Validates a list of documents to ingest. Each entry is a URL or a dict with
+    'url' and an optional 'source' display name; a single URL string is also
+    accepted. Returns [{'url', 'source'}] with repeated URLs dropped.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    entries = {}
+    for entry in sources:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if not isinstance(entry, dict) or not entry.get("url"):
+            raise ValueError(f"Manifest entries must be URLs or objects with a 'url', got {entry!r}")
+        url = entry["url"]
+        entries.setdefault(url, {"url": url, "source": entry.get("source") or default_source_name(url)})
+    return list(entries.values())
+
+def load_ingest_manifest(path=INGEST_MANIFEST_PATH):
+    """
+    Reads the documents to ingest from a JSON manifest: a list of entries (see
+    normalize_manifest()) or an object with a 'sources' list. Without a
+    manifest, ingestion covers the investor PDF alone.
+    """
+    if not path:
+        return [{"url": INVESTOR_PDF_URL, "source": INVESTOR_PDF_SOURCE}]
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("sources", [])
+    return normalize_manifest(manifest)
+
+def _content_hash(text):
+    """Returns the SHA-256 hex digest of a chunk's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _chunk_id(source, page, content_hash, occurrence=0):
+    """Builds a deterministic chunk id from the source, page and content hash."""
+    # occurrence disambiguates identical chunks repeated on the same page
+    key = f"{source}|{page}|{content_hash}|{occurrence}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def _iter_chunks(pdf_url, source=None):
+    """
+    Lazily loads PDF pages and yields their chunks one page at a time, with
+    source, url, content_hash and a deterministic chunk_id in each chunk's
+    metadata.
+    """
+    # Imported here so the serving path does not load LangChain's text splitter
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    source = source or default_source_name(pdf_url)
     # Split the data into chunks (from notebook)
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    documents = text_splitter.split_documents(data)
-    logger.info(f"Split PDF into {len(documents)} chunks.")
-
-    # Prepare documents for insertion (from notebook)
-    for i, doc in enumerate(documents[:5]):
-        logger.info(f"[CHUNK METADATA DEBUG] Chunk {i} metadata: {doc.metadata}")
-    docs_to_insert = [{
-        "text": doc.page_content,
-        "embedding": get_embedding(doc.page_content),
-        # Use 'page_label' if present, else fallback to 'page', else None
-        "page_number": doc.metadata.get("page_label") or doc.metadata.get("page", None)
-    } for doc in documents]
-
-    logger.info("Inserting documents into MongoDB...")
+    # Pages arrive in order while later page ranges are still being extracted
+    for page in iter_pdf_pages(pdf_url):
+        occurrences = {}
+        for chunk in text_splitter.split_documents([page]):
+            content_hash = _content_hash(chunk.page_content)
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
+            chunk.metadata["source"] = source
+            chunk.metadata["url"] = pdf_url
+            chunk.metadata["content_hash"] = content_hash
+            # Keyed on the URL, so renaming a source does not re-embed its chunks
+            chunk.metadata["chunk_id"] = _chunk_id(pdf_url, chunk.metadata.get("page"), content_hash, occurrence)
+            yield chunk
+
+def _iter_batches(items, batch_size):
+    """Groups an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _put(stage_queue, item, stop_event):
+    """Blocks on a bounded queue until there is room or the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(stage_queue, stop_event):
+    """Blocks on a queue until an item arrives or the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _STAGE_DONE
+
+def _write_batch(collection, docs):
+    """
+    Writes one batch with an unordered bulk upsert keyed on the chunk id. Only
+    the documents that failed are retried, with exponential backoff between
+    attempts; upserts are idempotent, so retries never duplicate chunks.
+    """
+    pending = docs
+    for attempt in range(1, INGEST_WRITE_RETRIES + 1):
+        try:
+            collection.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in pending], ordered=False)
+            return
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            pending = [doc for i, doc in enumerate(pending) if i in failed]
+            if not pending:
+                return
+            error = e
+        except PyMongoError as e:
+            error = e
+        if attempt < INGEST_WRITE_RETRIES:
+            delay = INGEST_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.warning(f"Batch write attempt {attempt} failed for {len(pending)} documents: {error}. Retrying in {delay:.1f}s.")
+            time.sleep(delay)
+    raise error
+
+def _delete_stale_chunks(collection, stale_ids, batch_size=1000):
+    """Deletes chunks that are no longer produced by their source."""
+    deleted = 0
+    for ids in _iter_batches(stale_ids, batch_size):
+        deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+    return deleted
+
+def _check_cancelled(cancel_event, what):
+    """Raises IngestionCancelled if cancel_event is set."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise IngestionCancelled(f"{what} was cancelled.")
+
+def _prepare_projection(sources, stage_callback=None, cancel_event=None):
+    """
+    Returns the projection applied to stored vectors (None at full size). When
+    a PCA projection is configured but not fitted yet, it is fitted on the
+    first EMBEDDING_PROJECTION_FIT_SAMPLES chunks of the manifest and saved.
+    Setting cancel_event stops the fit with IngestionCancelled; nothing is saved.
+    """
+    if not reduction_enabled():
+        return None
     try:
-        result = collection.insert_many(docs_to_insert)
-        logger.info(f"Inserted {len(result.inserted_ids)} documents successfully.")
+        return get_embedding_projection()
+    except ProjectionNotFitted:
+        pass
+    if stage_callback:
+        stage_callback("fitting projection")
+    chunks = itertools.chain.from_iterable(_iter_chunks(entry["url"], entry["source"]) for entry in sources)
+    texts = []
+    for chunk in itertools.islice(chunks, EMBEDDING_PROJECTION_FIT_SAMPLES):
+        _check_cancelled(cancel_event, "Fitting the embedding projection")
+        texts.append(chunk.page_content)
+    logger.info(f"Fitting a {EMBEDDING_DIMENSIONS}-dimension PCA projection on {len(texts)} chunks...")
+    # These embeddings land in the embedding cache, so the ingestion pass reuses them
+    embeddings = get_embeddings(
+        texts, progress_callback=lambda done, total: _check_cancelled(cancel_event, "Fitting the embedding projection")
+    )
+    _check_cancelled(cancel_event, "Fitting the embedding projection")
+    projection = EmbeddingProjection.fit(embeddings, EMBEDDING_DIMENSIONS)
+    save_embedding_projection(projection)
+    return projection
+
+# Chunks written before ingestion recorded each chunk's document
+_UNATTRIBUTED_CHUNKS = {"source": {"$exists": False}, "url": {"$exists": False}}
 
-        # Create vector search index
-        create_vector_search_index(collection)
+class IngestionCancelled(Exception):
+    """Raised when an ingestion run is cancelled through its cancel_event."""
 
+def _ingest_source(collection, entry, projection, ingested_at, progress_callback=None, cancel_event=None):
+    """
+    Runs the streaming pipeline for one document and prunes the chunks it no
+    longer produces. Returns the document's processed, upserted and deleted
+    chunk counts.
+    """
+    pdf_url, source = entry["url"], entry["source"]
+    if cancel_event is not None and cancel_event.is_set():
+        raise IngestionCancelled(f"Ingestion of {pdf_url} was cancelled.")
+    projection_id = projection.projection_id if projection else None
+    vector_format = {"projection": projection_id, "vector_storage": EMBEDDING_STORAGE}
+    # Chunks stored before the url field existed are keyed on their source
+    stored = [{"url": pdf_url}, {"url": {"$exists": False}, "source": pdf_url}]
+    if pdf_url == INVESTOR_PDF_URL:
+        # The original ingestion stored the investor PDF under ObjectIds with no source
+        stored.append(_UNATTRIBUTED_CHUNKS)
+    existing_ids = {doc["_id"] for doc in collection.find({"$or": stored}, {"_id": 1})}
+    # Chunks stored under another projection, dimension or storage type, or
+    # without the filter fields, are rewritten
+    current_ids = {doc["_id"] for doc in collection.find(
+        {"url": pdf_url, "source": source, "ingested_at": {"$exists": True}, **vector_format}, {"_id": 1}
+    )}
+    seen_ids = set()
+    chunk_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    stop_event = threading.Event()
+    errors = []
+    written = [0]
+
+    def produce_chunks():
+        try:
+            for batch in _iter_batches(_iter_chunks(pdf_url, source), EMBEDDING_BATCH_SIZE):
+                if not _put(chunk_queue, batch, stop_event):
+                    return
+        except Exception as e:
+            logger.error(f"Error loading PDF from {pdf_url}: {e}")
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(chunk_queue, _STAGE_DONE, stop_event)
+
+    def write_batches():
+        try:
+            while True:
+                docs = _get(write_queue, stop_event)
+                if docs is _STAGE_DONE:
+                    return
+                _write_batch(collection, docs)
+                written[0] += len(docs)
+        except Exception as e:
+            logger.error(f"Error during document insertion: {e}")
+            errors.append(e)
+            stop_event.set()
+
+    logger.info(f"Loading PDF from {pdf_url} ({len(existing_ids)} chunks already stored)...")
+    start_time = time.perf_counter()
+    producer = threading.Thread(target=produce_chunks, name="ingest-chunker", daemon=True)
+    writer = threading.Thread(target=write_batches, name="ingest-writer", daemon=True)
+    producer.start()
+    writer.start()
+
+    processed = 0
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise IngestionCancelled(f"Ingestion of {pdf_url} was cancelled.")
+            batch = _get(chunk_queue, stop_event)
+            if batch is _STAGE_DONE:
+                break
+            if processed == 0:
+                for i, doc in enumerate(batch[:5]):
+                    logger.info(f"[CHUNK METADATA DEBUG] Chunk {i} metadata: {doc.metadata}")
+            processed += len(batch)
+            seen_ids.update(doc.metadata["chunk_id"] for doc in batch)
+            # The id includes the content hash, so a stored id means an unchanged chunk
+            new_chunks = [doc for doc in batch if doc.metadata["chunk_id"] not in current_ids]
+            if new_chunks:
+                # Concurrent documents share model batches through the ingestion batcher
+                embeddings = get_ingest_embeddings([doc.page_content for doc in new_chunks])
+                if projection:
+                    embeddings = projection.project_many(embeddings)
+                docs_to_insert = [{
+                    "_id": doc.metadata["chunk_id"],
+                    "text": doc.page_content,
+                    "embedding": encode_vector(embedding),
+                    # Use 'page_label' if present, else fallback to 'page', else None
+                    "page_number": doc.metadata.get("page_label") or doc.metadata.get("page", None),
+                    # 1-based physical page, for page range filters
+                    "pdf_page": doc.metadata["page"] + 1 if doc.metadata.get("page") is not None else None,
+                    "ingested_at": ingested_at,
+                    "source": doc.metadata["source"],
+                    "url": doc.metadata["url"],
+                    "content_hash": doc.metadata["content_hash"],
+                    "projection": projection_id,
+                    "vector_storage": EMBEDDING_STORAGE
+                } for doc, embedding in zip(new_chunks, embeddings)]
+                if not _put(write_queue, docs_to_insert, stop_event):
+                    break
+            if progress_callback:
+                # Extrapolate the chunk count from the pages seen so far
+                last_page = batch[-1].metadata
+                total_pages = last_page.get("total_pages")
+                estimated_total = None
+                if total_pages:
+                    estimated_total = max(processed, round(processed / (last_page.get("page", 0) + 1) * total_pages))
+                progress_callback(processed, estimated_total)
     except Exception as e:
-        logger.error(f"Error during document insertion: {e}")
-        raise
+        if isinstance(e, IngestionCancelled):
+            logger.info(str(e))
+        else:
+            logger.error(f"Error generating embeddings: {e}")
+        errors.append(e)
+        stop_event.set()
+    finally:
+        _put(write_queue, _STAGE_DONE, stop_event)
+        producer.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+    # Only prune after a complete pass, so a failed run never deletes live chunks
+    deleted = _delete_stale_chunks(collection, list(existing_ids - seen_ids))
+    if progress_callback:
+        progress_callback(processed, processed)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Processed {processed} chunks of '{source}' in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.1f} chunks/s): "
+        f"{written[0]} upserted, {processed - written[0]} unchanged, {deleted} deleted."
+    )
+    return {"processed": processed, "upserted": written[0], "deleted": deleted}
+
+class _ManifestProgress:
+    """
+    Combines per-document progress into one (done, total) report. The total
+    extrapolates the average size of documents seen so far to the ones not
+    started yet.
+    """
+    def __init__(self, callback, document_count):
+        self.callback = callback
+        self.document_count = document_count
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def for_document(self, url):
+        def report(done, total):
+            with self._lock:
+                self._documents[url] = (done, total)
+                done_all = sum(d for d, _ in self._documents.values())
+                totals = [t for _, t in self._documents.values() if t]
+                total_all = None
+                if totals:
+                    total_all = sum(totals) + round(sum(totals) / len(totals) * (self.document_count - len(totals)))
+                    total_all = max(done_all, total_all)
+                # Called under the lock, so callbacks never interleave
+                self.callback(done_all, total_all)
+        return report
+
+def ingest_documents_to_mongodb(sources=None, progress_callback=_log_embedding_progress, stage_callback=None,
+                                cancel_event=None, concurrency=INGEST_DOCUMENT_CONCURRENCY, wait_for_index=False):
+    """
+    Loads PDFs, chunks them, generates embeddings, and stores in MongoDB Atlas (from notebook).
+    sources defaults to the ingest manifest (see normalize_manifest()). Chunks are
+    upserted idempotently and a failed document does not stop the others; returns
+    the ingested documents, the chunk counts and the failed documents.
+    """
+    sources = load_ingest_manifest() if sources is None else normalize_manifest(sources)
+    if not sources:
+        raise ValueError("No documents to ingest.")
+    projection = _prepare_projection(sources, stage_callback, cancel_event)
+    projection_id = projection.projection_id if projection else None
+    if stage_callback:
+        stage_callback("chunking")
+    collection = get_mongo_collection("ingest")
+    collection.create_index("source")
+    collection.create_index("url")
+    ingested_at = datetime.datetime.now(datetime.timezone.utc)
+    progress = _ManifestProgress(progress_callback, len(sources)) if progress_callback else None
+
+    logger.info(f"Ingesting {len(sources)} documents, {concurrency} at a time...")
+    start_time = time.perf_counter()
+    totals = {"documents": 0, "processed": 0, "upserted": 0, "deleted": 0}
+    failed = []
+    first_error = None
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(sources))), thread_name_prefix="ingest-document") as executor:
+        futures = {
+            executor.submit(
+                _ingest_source, collection, entry, projection, ingested_at,
+                progress.for_document(entry["url"]) if progress else None, cancel_event
+            ): entry
+            for entry in sources
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                result = future.result()
+            except IngestionCancelled:
+                continue
+            except Exception as e:
+                logger.error(f"Ingestion of '{entry['source']}' ({entry['url']}) failed: {e}")
+                failed.append({**entry, "error": str(e)})
+                first_error = first_error or e
+                continue
+            totals["documents"] += 1
+            for key in ("processed", "upserted", "deleted"):
+                totals[key] += result[key]
+
+    if cancel_event is not None and cancel_event.is_set():
+        # Chunks written before the cancel stay; they are current and searchable
+        invalidate_answer_cache()
+        raise IngestionCancelled(f"Ingestion of {len(sources)} documents was cancelled.")
+    if first_error is not None and not totals["documents"]:
+        raise first_error
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Ingested {totals['documents']}/{len(sources)} documents ({totals['processed']} chunks) in {elapsed:.1f}s "
+        f"({totals['processed'] / max(elapsed, 1e-9):.1f} chunks/s): {totals['upserted']} upserted, "
+        f"{totals['deleted']} deleted, {len(failed)} failed."
+    )
+    unattributed = collection.count_documents(_UNATTRIBUTED_CHUNKS)
+    if unattributed:
+        logger.warning(
+            f"{unattributed} chunks have no source; they were stored by the original ingestion of {INVESTOR_PDF_URL} "
+            f"and are pruned when it is ingested again."
+        )
+    outdated = collection.count_documents({
+        "$nor": [{"projection": projection_id, "vector_storage": EMBEDDING_STORAGE}, _UNATTRIBUTED_CHUNKS]
+    })
+    if outdated:
+        logger.warning(
+            f"{outdated} chunks from other sources use a different vector format; "
+            "re-ingest those sources to make them searchable."
+        )
+    if totals["upserted"] or totals["deleted"]:
+        invalidate_answer_cache()
+        if RETRIEVAL_BACKEND == "local" or (RETRIEVAL_MODE == "hybrid" and TEXT_SEARCH_BACKEND == "local"):
+            # Read from the primary: a lagging secondary may not have the chunks just written
+            build_snapshot(collection, query={"projection": projection_id})
+            reload_local_vector_store()
 
-def get_query_results(query):
-    """Gets results from a vector search query (from notebook)."""
-    collection = get_mongo_collection()
-    query_embedding = get_embedding(query)
+    # Create vector search index
+    if stage_callback:
+        stage_callback("indexing")
+    _check_cancelled(cancel_event, f"Ingestion of {len(sources)} documents")
+    try:
+        ensure_vector_search_index(collection, wait=wait_for_index, cancel_event=cancel_event)
+    except TimeoutError as e:
+        # Ingested data is already stored; the index keeps building in Atlas
+        logger.warning(str(e))
+    if RETRIEVAL_MODE == "hybrid" and TEXT_SEARCH_BACKEND == "atlas":
+        try:
+            ensure_text_search_index(collection)
+        except Exception as e:
+            logger.error(f"Error provisioning text search index: {e}")
+
+    return {**totals, "failed": failed}
+
+SEARCH_FILTER_KEYS = ("source", "url", "page_numbers", "page_from", "page_to", "ingested_after", "ingested_before")
+
+def _check_search_filter(search_filter):
+    unknown = set(search_filter) - set(SEARCH_FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown search filter keys {sorted(unknown)}, expected some of {SEARCH_FILTER_KEYS}")
+
+def build_search_filter(search_filter):
+    """
+    Translates a metadata filter into the MQL for $vectorSearch.filter. Keys:
+    'source' (document name), 'url' (document URL), 'page_numbers' (page labels), 'page_from'/'page_to'
+    (1-based PDF pages, inclusive) and 'ingested_after'/'ingested_before'
+    (datetimes). Returns None for an empty filter.
+    """
+    if not search_filter:
+        return None
+    _check_search_filter(search_filter)
+    clauses = []
+    for field in ("source", "url"):
+        if search_filter.get(field):
+            clauses.append({field: {"$eq": search_filter[field]}})
+    if search_filter.get("page_numbers"):
+        clauses.append({"page_number": {"$in": [str(page) for page in search_filter["page_numbers"]]}})
+    for field, lower, upper in (("pdf_page", "page_from", "page_to"), ("ingested_at", "ingested_after", "ingested_before")):
+        bounds = {}
+        if search_filter.get(lower) is not None:
+            bounds["$gte"] = search_filter[lower]
+        if search_filter.get(upper) is not None:
+            bounds["$lte"] = search_filter[upper]
+        if bounds:
+            clauses.append({field: bounds})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def _text_search_filter_clauses(search_filter):
+    """The same filter as Atlas Search compound filter clauses."""
+    if not search_filter:
+        return []
+    _check_search_filter(search_filter)
+    clauses = []
+    for field in ("source", "url"):
+        if search_filter.get(field):
+            clauses.append({"equals": {"path": field, "value": search_filter[field]}})
+    if search_filter.get("page_numbers"):
+        clauses.append({"in": {"path": "page_number", "value": [str(page) for page in search_filter["page_numbers"]]}})
+    for field, lower, upper in (("pdf_page", "page_from", "page_to"), ("ingested_at", "ingested_after", "ingested_before")):
+        bounds = {}
+        if search_filter.get(lower) is not None:
+            bounds["gte"] = search_filter[lower]
+        if search_filter.get(upper) is not None:
+            bounds["lte"] = search_filter[upper]
+        if bounds:
+            clauses.append({"range": {"path": field, **bounds}})
+    return clauses
+
+def _vector_format_filter():
+    """Restricts a search to chunks stored under the current projection and vector storage."""
+    return [{"projection": {"$eq": current_projection_id()}}, {"vector_storage": {"$eq": EMBEDDING_STORAGE}}]
 
-    pipeline = [
+def build_vector_search_stage(query_embedding, limit=None, num_candidates=None, exact=None, search_filter=None):
+    """
+    Builds the $vectorSearch stage. Approximate (HNSW) search considers
+    num_candidates nearest neighbours; exact search scans every vector and is
+    kept for evaluation. Unset arguments fall back to the configured defaults.
+    The query vector is sent as a packed binary vector in the stored format.
+    search_filter (see build_search_filter()) narrows the candidates inside
+    the index, which only holds chunks in the current vector format.
+    """
+    limit = limit or VECTOR_SEARCH_LIMIT
+    exact = VECTOR_SEARCH_MODE == "exact" if exact is None else exact
+    stage = {
+        "index": VECTOR_SEARCH_INDEX_NAME,
+        "queryVector": encode_vector(query_embedding),
+        "path": "embedding",
+        "limit": limit
+    }
+    if exact:
+        stage["exact"] = True
+    else:
+        # numCandidates must be at least limit
+        stage["numCandidates"] = max(num_candidates or VECTOR_SEARCH_NUM_CANDIDATES, limit)
+    mql_filter = build_search_filter(search_filter)
+    stage["filter"] = {"$and": _vector_format_filter() + ([mql_filter] if mql_filter else [])}
+    return {"$vectorSearch": stage}
+
+def _results_pipeline(query_embedding, limit=None, num_candidates=None, exact=None, search_filter=None):
+    """Vector search pipeline projecting the fields the RAG chain uses."""
+    return [
+        build_vector_search_stage(query_embedding, limit, num_candidates, exact, search_filter),
         {
-            "$vectorSearch": {
-                "index": VECTOR_SEARCH_INDEX_NAME,
-                "queryVector": query_embedding,
-                "path": "embedding",
-                "exact": True,
-                "limit": 3
-            }
-        }, {
             "$project": {
                 "_id": 0,
                 "text": 1,
-                "page_number": 1
+                "page_number": 1,
+                "source": 1,
+                "url": 1,
+                # Packed binary vectors are small; the chain uses them for MMR dedup
+                "embedding": 1
             }
         }
     ]
 
+def _text_search_pipeline(query, limit, search_filter=None):
+    """Atlas Search pipeline for the full-text leg of hybrid retrieval."""
+    # Same vector format restriction as the vector leg, so fused results stay comparable
+    format_clauses = [
+        {"equals": {"path": "projection", "value": current_projection_id()}},
+        {"equals": {"path": "vector_storage", "value": EMBEDDING_STORAGE}}
+    ]
+    operator = {"compound": {
+        "must": [{"text": {"query": query, "path": "text"}}],
+        "filter": format_clauses + _text_search_filter_clauses(search_filter)
+    }}
+    return [
+        {"$search": {"index": TEXT_SEARCH_INDEX_NAME, **operator}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "text": 1, "page_number": 1, "source": 1, "url": 1, "embedding": 1}}
+    ]
+
+def reciprocal_rank_fusion(result_lists, weights, limit):
+    """
+    Merges ranked result lists with weighted reciprocal rank fusion: a chunk
+    scores weight / (HYBRID_RRF_K + rank) in every list it appears in (ranks
+    start at 1). Chunks are matched by document, text and page number.
+    """
+    scores = {}
+    docs = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = (doc.get("url"), doc["text"], doc.get("page_number"))
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (HYBRID_RRF_K + rank)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:limit]]
+
+def _fuse_hybrid_results(vector_results, text_results, limit):
+    if isinstance(text_results, Exception):
+        # Keep answering (e.g. while the text index builds), on vector results alone
+        logger.warning(f"Full-text search failed, using vector results only: {text_results}")
+        text_results = []
+    return reciprocal_rank_fusion([vector_results, text_results], [HYBRID_VECTOR_WEIGHT, HYBRID_TEXT_WEIGHT], limit)
+
+def get_text_search_results(query, limit=None, search_filter=None):
+    """Full-text search: Atlas Search, or BM25 over the local snapshot with TEXT_SEARCH_BACKEND=local."""
+    limit = limit or HYBRID_TEXT_LIMIT
+    if TEXT_SEARCH_BACKEND == "local":
+        return get_local_vector_store().text_search(query, limit, search_filter)
+    return list(get_mongo_collection("search").aggregate(_text_search_pipeline(query, limit, search_filter)))
+
+async def aget_text_search_results(query, limit=None, search_filter=None):
+    """Async counterpart of get_text_search_results()."""
+    limit = limit or HYBRID_TEXT_LIMIT
+    if TEXT_SEARCH_BACKEND == "local":
+        # Off the loop: the first call (and any new snapshot) loads the store
+        return await asyncio.to_thread(lambda: get_local_vector_store().text_search(query, limit, search_filter))
+    # The pipeline filters on the current projection id
+    await aget_embedding_projection()
+    collection = await get_async_mongo_collection("search")
+    cursor = await collection.aggregate(_text_search_pipeline(query, limit, search_filter))
+    return await cursor.to_list(length=None)
+
+def _vector_results(query_embedding, limit, num_candidates, exact, search_filter):
+    query_embedding = project_query_embedding(query_embedding)
+    if RETRIEVAL_BACKEND == "local":
+        return get_local_vector_store().search(query_embedding, limit, search_filter)
+
+    collection = get_mongo_collection("search")
+    pipeline = _results_pipeline(query_embedding, limit, num_candidates, exact, search_filter)
+
     results = collection.aggregate(pipeline)
     array_of_results = []
     for doc in results:
         array_of_results.append(doc)
     return array_of_results
 
+async def _avector_results(query_embedding, limit, num_candidates, exact, search_filter):
+    # A small in-memory matmul once the projection is loaded
+    query_embedding = await aproject_query_embedding(query_embedding)
+    if RETRIEVAL_BACKEND == "local":
+        # Off the loop: loading or reloading the snapshot parses its whole
+        # manifest, and filtered scans copy the matching rows
+        return await asyncio.to_thread(lambda: get_local_vector_store().search(query_embedding, limit, search_filter))
+
+    collection = await get_async_mongo_collection("search")
+    cursor = await collection.aggregate(_results_pipeline(query_embedding, limit, num_candidates, exact, search_filter))
+    return await cursor.to_list(length=None)
+
+def get_query_results(query, query_embedding=None, limit=None, num_candidates=None, exact=None, mode=None, search_filter=None):
+    """
+    Gets results from a vector search query (from notebook). Pass query_embedding
+    (the model's full-size embedding) to skip embedding the query; it is
+    projected like the stored vectors. limit, num_candidates and exact override
+    the configured retrieval mode. With RETRIEVAL_BACKEND=local the search runs
+    against the in-process snapshot instead of Atlas.
+
+    With mode (default RETRIEVAL_MODE) 'hybrid', a full-text search runs
+    concurrently with the vector search and the two rankings are fused.
+    search_filter restricts results by source, page or ingestion date (see
+    build_search_filter()); it is applied inside the index, before ranking.
+    """
+    if (mode or RETRIEVAL_MODE) != "hybrid":
+        if query_embedding is None:
+            query_embedding = get_query_embedding(query)
+        return _vector_results(query_embedding, limit, num_candidates, exact, search_filter)
+
+    limit = limit or VECTOR_SEARCH_LIMIT
+    # The text leg does not need the query embedding, so it starts first
+    text_future = _text_search_executor.submit(get_text_search_results, query, None, search_filter)
+    if query_embedding is None:
+        query_embedding = get_query_embedding(query)
+    vector_results = _vector_results(query_embedding, max(HYBRID_VECTOR_LIMIT, limit), num_candidates, exact, search_filter)
+    try:
+        text_results = text_future.result()
+    except Exception as e:
+        text_results = e
+    return _fuse_hybrid_results(vector_results, text_results, limit)
+
+async def aget_query_results(query, query_embedding=None, limit=None, num_candidates=None, exact=None, mode=None, search_filter=None):
+    """Async counterpart of get_query_results() using the async driver; never blocks the event loop."""
+    if (mode or RETRIEVAL_MODE) != "hybrid":
+        if query_embedding is None:
+            query_embedding = await aget_query_embedding(query)
+        return await _avector_results(query_embedding, limit, num_candidates, exact, search_filter)
+
+    limit = limit or VECTOR_SEARCH_LIMIT
+
+    async def vector_leg():
+        embedding = query_embedding if query_embedding is not None else await aget_query_embedding(query)
+        return await _avector_results(embedding, max(HYBRID_VECTOR_LIMIT, limit), num_candidates, exact, search_filter)
+
+    vector_results, text_results = await asyncio.gather(
+        vector_leg(), aget_text_search_results(query, search_filter=search_filter), return_exceptions=True
+    )
+    if isinstance(vector_results, BaseException):
+        raise vector_results
+    return _fuse_hybrid_results(vector_results, text_results, limit)
+
 if __name__ == "__main__":
+    # Run as a job so the CLI takes the same collection lease as the API
+    from ingest_jobs import run_ingest_job, IngestionAlreadyRunning
+    # This script runs as __main__; ingest_jobs uses the imported db_utils module
+    import db_utils
     logger.info("Starting document ingestion process...")
     try:
-        ingest_documents_to_mongodb()
-        logger.info("Document ingestion completed successfully.")
+        job = run_ingest_job(wait_for_index=True)
+        if job["status"] == "completed":
+            logger.info("Document ingestion completed successfully.")
+        else:
+            logger.error(f"Document ingestion {job['status']}: {job.get('error')}")
+    except IngestionAlreadyRunning as e:
+        logger.error(str(e))
     except Exception as e:
         logger.error(f"Document ingestion failed: {e}")
+    finally:
+        close_pdf_parse_pool()
+        db_utils.close_mongo_client()
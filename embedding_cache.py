@@ -0,0 +1,258 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/embedding_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES,
+    EMBEDDING_MODEL_NAME, EMBEDDING_MODEL_REVISION, EMBEDDING_BACKEND,
+    QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    RERANK_SCORE_CACHE_SIZE, RERANK_SCORE_CACHE_TTL_SECONDS
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+_query_embedding_cache = None
+_rerank_score_cache = None
+
+class LRUCache:
+    """Bounded, thread-safe in-memory LRU cache with a per-entry TTL."""
+    def __init__(self, capacity, ttl_seconds=None):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entry if full."""
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model name, revision, backend, text hash).
+
+    Backed by SQLite in WAL mode, so several uvicorn workers can share one file.
+    Entries are evicted least-recently-used first once the stored vectors exceed
+    max_bytes. The stored size is kept as a running total by triggers, so
+    writes never scan the table. Hit and miss counters are per process.
+    """
+    def __init__(self, path, max_bytes, model_name, revision=None, backend="torch"):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Quantized backends produce slightly different vectors, so they get their own keys
+        self.namespace = f"{model_name}@{revision or 'default'}/{backend}"
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        # One-row running total of stored bytes, maintained in the same transaction as each write
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings_size (id INTEGER PRIMARY KEY CHECK (id = 1), total INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO embeddings_size (id, total) SELECT 1, COALESCE(SUM(size), 0) FROM embeddings")
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings "
+            "BEGIN UPDATE embeddings_size SET total = total + NEW.size WHERE id = 1; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings "
+            "BEGIN UPDATE embeddings_size SET total = total - OLD.size WHERE id = 1; END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF size ON embeddings "
+            "BEGIN UPDATE embeddings_size SET total = total - OLD.size + NEW.size WHERE id = 1; END"
+        )
+        conn.commit()
+
+    def _connection(self):
+        """Returns this thread's SQLite connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def key(self, text):
+        """Cache key for a text under this model, revision and backend."""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def get_many(self, texts):
+        """Returns a list with the cached vector (float32 array) or None for each text."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        conn = self._connection()
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+            found.update(rows)
+            if rows:
+                conn.execute(
+                    f"UPDATE embeddings SET last_access = ? WHERE key IN ({','.join('?' * len(rows))})",
+                    [time.time()] + [row[0] for row in rows]
+                )
+        conn.commit()
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put_many(self, texts, vectors):
+        """Stores vectors for texts and evicts least-recently-used entries if over budget."""
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((self.key(text), blob, len(blob), now))
+        conn = self._connection()
+        # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete does not fire triggers
+        conn.executemany(
+            "INSERT INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET vector = excluded.vector, size = excluded.size, last_access = excluded.last_access",
+            rows
+        )
+        conn.commit()
+        self._evict(conn)
+
+    def _evict(self, conn):
+        """Deletes least-recently-used entries until the cache is under 90% of max_bytes."""
+        total = conn.execute("SELECT total FROM embeddings_size WHERE id = 1").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_access"):
+            evicted.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        conn.commit()
+        with self._stats_lock:
+            self.evictions += len(evicted)
+        logger.info(f"Evicted {len(evicted)} embeddings ({freed} bytes) from cache.")
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        conn = self._connection()
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        size = conn.execute("SELECT total FROM embeddings_size WHERE id = 1").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes
+        }
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache, or None if it is disabled or unavailable."""
+    global _embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                try:
+                    _embedding_cache = EmbeddingCache(
+                        EMBEDDING_CACHE_PATH,
+                        EMBEDDING_CACHE_MAX_BYTES,
+                        EMBEDDING_MODEL_NAME,
+                        EMBEDDING_MODEL_REVISION,
+                        EMBEDDING_BACKEND
+                    )
+                    logger.info(f"Embedding cache opened at {EMBEDDING_CACHE_PATH}.")
+                except Exception as e:
+                    logger.error(f"Error opening embedding cache at {EMBEDDING_CACHE_PATH}: {e}")
+                    return None
+    return _embedding_cache
+
+def get_query_embedding_cache():
+    """Returns the in-memory query embedding cache, or None if its capacity is 0."""
+    global _query_embedding_cache
+    if QUERY_EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    if _query_embedding_cache is None:
+        with _embedding_cache_lock:
+            if _query_embedding_cache is None:
+                _query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+    return _query_embedding_cache
+
+def get_rerank_score_cache():
+    """Returns the in-memory cache of cross-encoder scores per (query, chunk), or None if its capacity is 0."""
+    global _rerank_score_cache
+    if RERANK_SCORE_CACHE_SIZE <= 0:
+        return None
+    if _rerank_score_cache is None:
+        with _embedding_cache_lock:
+            if _rerank_score_cache is None:
+                _rerank_score_cache = LRUCache(RERANK_SCORE_CACHE_SIZE, RERANK_SCORE_CACHE_TTL_SECONDS)
+    return _rerank_score_cache
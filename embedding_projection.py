@@ -0,0 +1,178 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/embedding_projection.py
+import asyncio
+import datetime
+import logging
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from config import (
+    DB_NAME, COLLECTION_NAME, EMBEDDING_MODEL_NAME, EMBEDDING_MODEL_REVISION,
+    EMBEDDING_MODEL_DIMENSIONS, EMBEDDING_DIMENSIONS, EMBEDDING_REDUCTION, EMBEDDING_PROJECTIONS_COLLECTION
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDUCTION_METHODS = ("truncate", "pca")
+
+# After a lookup finds no fitted projection, it is not repeated for this long
+PROJECTION_RECHECK_SECONDS = 30
+
+_embedding_projection = None
+_embedding_projection_lock = threading.Lock()
+_projection_missing_until = 0.0
+
+class ProjectionNotFitted(Exception):
+    """Raised when a PCA projection is configured but none has been fitted for the collection yet."""
+
+def _model_namespace():
+    """
+    Identifies the model that produced the vectors a projection was fitted on.
+    The inference backend is left out: quantized backends agree closely enough
+    to share a projection, so switching backends needs no refit.
+    """
+    return f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_MODEL_REVISION or 'default'}"
+
+class EmbeddingProjection:
+    """
+    Maps model embeddings to a smaller number of dimensions, either by keeping
+    the leading components ('truncate') or by projecting onto principal
+    components fitted on the corpus ('pca'). Outputs are L2-normalized, so
+    cosine scores stay comparable across settings. projection_id names the
+    resulting vector space and is stored on every chunk.
+    """
+    def __init__(self, method, dimensions, mean=None, components=None, projection_id=None):
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"Unknown embedding reduction '{method}', expected one of {REDUCTION_METHODS}")
+        if not 0 < dimensions <= EMBEDDING_MODEL_DIMENSIONS:
+            raise ValueError(f"Embedding dimensions must be between 1 and {EMBEDDING_MODEL_DIMENSIONS}, got {dimensions}")
+        self.method = method
+        self.dimensions = dimensions
+        self.mean = mean
+        self.components = components
+        self.projection_id = projection_id or f"{method}-{dimensions}"
+
+    @classmethod
+    def fit(cls, vectors, dimensions):
+        """Fits a PCA projection on a sample of model embeddings (one row per chunk)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) <= dimensions:
+            raise ValueError(f"Fitting a {dimensions}-dimension projection needs more than {dimensions} chunks, got {len(vectors)}")
+        mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls("pca", dimensions, mean, np.ascontiguousarray(vt[:dimensions]), f"pca-{dimensions}-{uuid.uuid4().hex[:12]}")
+
+    def apply(self, vectors):
+        """Projects a (n, 768) array and returns an (n, dimensions) float32 array."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == "pca":
+            reduced = (vectors - self.mean) @ self.components.T
+        else:
+            reduced = vectors[:, :self.dimensions]
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return reduced / np.where(norms == 0, 1, norms)
+
+    def project_many(self, embeddings):
+        """Projects embeddings (one per row) and returns a float32 array."""
+        if not len(embeddings):
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return self.apply(embeddings)
+
+    def to_document(self):
+        return {
+            "_id": COLLECTION_NAME,
+            "projection_id": self.projection_id,
+            "method": self.method,
+            "dimensions": self.dimensions,
+            "model": _model_namespace(),
+            "mean": self.mean.astype(np.float32).tobytes(),
+            "components": self.components.astype(np.float32).tobytes(),
+            "fitted_at": datetime.datetime.now(datetime.timezone.utc)
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        mean = np.frombuffer(doc["mean"], dtype=np.float32)
+        components = np.frombuffer(doc["components"], dtype=np.float32).reshape(doc["dimensions"], -1)
+        return cls(doc["method"], doc["dimensions"], mean, components, doc["projection_id"])
+
+def reduction_enabled():
+    """True when stored vectors are smaller than the model's output."""
+    return EMBEDDING_DIMENSIONS < EMBEDDING_MODEL_DIMENSIONS
+
+def _projections():
+    # Imported here: db_utils imports this module
+    from db_utils import get_mongo_client
+    return get_mongo_client()[DB_NAME][EMBEDDING_PROJECTIONS_COLLECTION]
+
+def get_embedding_projection():
+    """
+    Returns the configured projection, or None when vectors keep the model's
+    full size. A PCA projection is loaded from MongoDB once per process; raises
+    ProjectionNotFitted if ingestion has not fitted one for this configuration.
+    """
+    global _embedding_projection, _projection_missing_until
+    if not reduction_enabled():
+        return None
+    if EMBEDDING_REDUCTION != "pca":
+        return EmbeddingProjection(EMBEDDING_REDUCTION, EMBEDDING_DIMENSIONS)
+    if _embedding_projection is None:
+        with _embedding_projection_lock:
+            if _embedding_projection is None:
+                doc = None
+                if time.monotonic() >= _projection_missing_until:
+                    doc = _projections().find_one({
+                        "_id": COLLECTION_NAME,
+                        "method": "pca",
+                        "dimensions": EMBEDDING_DIMENSIONS,
+                        # Projections saved with the backend in the namespace still match
+                        "model": {"$regex": f"^{re.escape(_model_namespace())}(/|$)"}
+                    })
+                if doc is None:
+                    _projection_missing_until = max(_projection_missing_until, time.monotonic() + PROJECTION_RECHECK_SECONDS)
+                    raise ProjectionNotFitted(
+                        f"No {EMBEDDING_DIMENSIONS}-dimension PCA projection has been fitted for '{COLLECTION_NAME}'; run ingestion first."
+                    )
+                _embedding_projection = EmbeddingProjection.from_document(doc)
+                logger.info(f"Loaded embedding projection {_embedding_projection.projection_id}.")
+    return _embedding_projection
+
+def save_embedding_projection(projection):
+    """Stores a fitted projection for the collection and makes it current in this process."""
+    global _embedding_projection, _projection_missing_until
+    _projections().replace_one({"_id": COLLECTION_NAME}, projection.to_document(), upsert=True)
+    with _embedding_projection_lock:
+        _embedding_projection = projection
+        _projection_missing_until = 0.0
+    logger.info(f"Saved embedding projection {projection.projection_id}.")
+
+def current_projection_id():
+    """The projection_id of stored vectors under the current configuration (None at full size)."""
+    projection = get_embedding_projection()
+    return projection.projection_id if projection else None
+
+def project_query_embedding(embedding):
+    """Maps a model embedding of a query into the stored vector space (float32)."""
+    projection = get_embedding_projection()
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return projection.apply(embedding[np.newaxis])[0] if projection else embedding
+
+def _projection_in_memory():
+    """True when get_embedding_projection() can answer without querying MongoDB."""
+    return (not reduction_enabled() or EMBEDDING_REDUCTION != "pca" or _embedding_projection is not None
+            or time.monotonic() < _projection_missing_until)
+
+async def aget_embedding_projection():
+    """Async counterpart of get_embedding_projection(); a projection not loaded yet is read off the event loop."""
+    if not _projection_in_memory():
+        return await asyncio.to_thread(get_embedding_projection)
+    return get_embedding_projection()
+
+async def aproject_query_embedding(embedding):
+    """Async counterpart of project_query_embedding()."""
+    await aget_embedding_projection()
+    return project_query_embedding(embedding)
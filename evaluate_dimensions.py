@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Reports what reduced-dimension vectors save and what they cost in recall. For
+each dimension and reduction method ('truncate' or 'pca'), sampled chunks and
+the evaluation queries are re-embedded, projected and searched exactly;
+recall@k is measured against full-size (768) search over the same sample,
+for float32 and for int8-quantized vectors. Storage is extrapolated to the
+whole collection; latency is an in-process exact scan over the sample, so
+compare it relatively (run evaluate_retrieval.py after switching to measure
+Atlas itself).
+
+Usage:
+    python evaluate_dimensions.py --dimensions 512 384 256 128 --sample-chunks 2000
+    python evaluate_dimensions.py --methods pca --queries questions.txt
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from config import EMBEDDING_MODEL_DIMENSIONS, VECTOR_SEARCH_LIMIT
+from db_utils import close_mongo_client, get_mongo_collection
+from bson_vectors import int8_scale, quantize_int8
+from embedding_projection import REDUCTION_METHODS, EmbeddingProjection
+from evaluate_retrieval import load_queries, percentile
+from rag_models import get_embeddings, get_query_embeddings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def bson_array_bytes(dimensions):
+    """Size of an embedding stored as a BSON array of doubles (the legacy format)."""
+    # Each element: type byte, decimal index key with terminator, 8-byte double
+    keys = sum(len(str(i)) + 1 for i in range(dimensions))
+    return 4 + dimensions * (1 + 8) + keys + 1
+
+def bson_binary_bytes(dimensions, storage):
+    """Size of an embedding stored as a packed BSON binary vector."""
+    # Length, subtype, then the vector's dtype and padding bytes
+    return 4 + 1 + 2 + dimensions * (1 if storage == "int8" else 4)
+
+def dequantized(vectors):
+    """Unit vectors after an int8 round trip, as the index sees them."""
+    return quantize_int8(vectors).astype(np.float32) * int8_scale(vectors.shape[-1])
+
+def top_k(corpus, queries, k):
+    """Exact cosine top-k row ids for each query (inputs are L2-normalized)."""
+    scores = queries @ corpus.T
+    return [set(row) for row in np.argpartition(-scores, k, axis=1)[:, :k]]
+
+def search_latencies(corpus, queries, k, repeats):
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            scores = corpus @ query
+            np.argpartition(-scores, k)[:k]
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def evaluate(corpus, queries, k, dimensions_settings, methods, repeats=3):
+    """Returns one report row for full-size vectors and one per (method, dimensions)."""
+    full = EmbeddingProjection("truncate", EMBEDDING_MODEL_DIMENSIONS)
+    corpus_full, queries_full = full.apply(corpus), full.apply(queries)
+    expected = top_k(corpus_full, queries_full, k)
+    latencies = search_latencies(corpus_full, queries_full, k, repeats)
+    found = top_k(dequantized(corpus_full), dequantized(queries_full), k)
+    rows = [{"setting": f"full {EMBEDDING_MODEL_DIMENSIONS}", "dimensions": EMBEDDING_MODEL_DIMENSIONS, "recall": 1.0,
+             "recall_int8": statistics.mean(len(e & f) / k for e, f in zip(expected, found)),
+             "p50_ms": statistics.median(latencies), "p95_ms": percentile(latencies, 95)}]
+
+    for method in methods:
+        for dimensions in dimensions_settings:
+            if method == "pca":
+                projection = EmbeddingProjection.fit(corpus, dimensions)
+            else:
+                projection = EmbeddingProjection("truncate", dimensions)
+            corpus_reduced, queries_reduced = projection.apply(corpus), projection.apply(queries)
+            found = top_k(corpus_reduced, queries_reduced, k)
+            found_int8 = top_k(dequantized(corpus_reduced), dequantized(queries_reduced), k)
+            latencies = search_latencies(corpus_reduced, queries_reduced, k, repeats)
+            rows.append({
+                "setting": f"{method} {dimensions}",
+                "dimensions": dimensions,
+                "recall": statistics.mean(len(e & f) / k for e, f in zip(expected, found)),
+                "recall_int8": statistics.mean(len(e & f) / k for e, f in zip(expected, found_int8)),
+                "p50_ms": statistics.median(latencies),
+                "p95_ms": percentile(latencies, 95)
+            })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[512, 384, 256, 128])
+    parser.add_argument("--methods", nargs="+", choices=REDUCTION_METHODS, default=list(REDUCTION_METHODS))
+    parser.add_argument("--k", type=int, default=VECTOR_SEARCH_LIMIT, help="results per query (limit)")
+    parser.add_argument("--sample-chunks", type=int, default=2000, help="stored chunks searched (and PCA fitted on)")
+    parser.add_argument("--queries", help="file with one query per line")
+    parser.add_argument("--query-chunks", type=int, default=0, help="use N random stored chunks as queries")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per query and setting")
+    args = parser.parse_args(argv)
+
+    try:
+        collection = get_mongo_collection("search")
+        total_chunks = collection.estimated_document_count()
+        texts = [doc["text"] for doc in collection.aggregate([{"$sample": {"size": args.sample_chunks}}, {"$project": {"text": 1}}])]
+        queries = load_queries(args.queries, args.query_chunks)
+    finally:
+        close_mongo_client()
+    if len(texts) <= args.k:
+        logger.error(f"Need more than {args.k} stored chunks, found {len(texts)}.")
+        return 1
+    dimensions_settings = [d for d in args.dimensions if d < EMBEDDING_MODEL_DIMENSIONS and ("pca" not in args.methods or d < len(texts))]
+
+    logger.info(f"Embedding {len(texts)} chunks and {len(queries)} queries at full size...")
+    corpus = np.asarray(get_embeddings(texts), dtype=np.float32)
+    query_vectors = np.asarray(get_query_embeddings(queries), dtype=np.float32)
+    rows = evaluate(corpus, query_vectors, args.k, dimensions_settings, args.methods, args.repeats)
+
+    legacy_mb = total_chunks * bson_array_bytes(EMBEDDING_MODEL_DIMENSIONS) / 2**20
+    print(f"\nSample: {len(texts)} chunks, {len(queries)} queries. Collection: {total_chunks} chunks, "
+          f"{legacy_mb:.1f} MB of vectors as arrays of doubles.")
+    print(f"{'setting':<14}{'recall@' + str(args.k):>10}{'int8':>8}{'p50 ms':>9}{'p95 ms':>9}{'f32 MB':>9}{'int8 MB':>9}")
+    for row in rows:
+        # Packed vectors are also what the index holds in memory
+        f32_mb = total_chunks * bson_binary_bytes(row["dimensions"], "float32") / 2**20
+        int8_mb = total_chunks * bson_binary_bytes(row["dimensions"], "int8") / 2**20
+        print(f"{row['setting']:<14}{row['recall']:>10.3f}{row['recall_int8']:>8.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}"
+              f"{f32_mb:>9.1f}{int8_mb:>9.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
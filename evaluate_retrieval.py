@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Reports recall@k of approximate (ANN) vector search against exact search, and
+the query latency at each numCandidates setting.
+
+Usage:
+    python evaluate_retrieval.py --k 3 --num-candidates 10 25 50 100 200
+    python evaluate_retrieval.py --queries questions.txt
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+
+from config import VECTOR_SEARCH_LIMIT
+from db_utils import build_vector_search_stage, close_mongo_client, get_mongo_collection
+from rag_models import get_query_embedding
+from embedding_projection import project_query_embedding
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = [
+    "What are MongoDB's latest AI announcements?",
+    "What was MongoDB's total revenue for the quarter?",
+    "How did Atlas revenue grow year over year?",
+    "What guidance did MongoDB give for the next fiscal year?",
+    "How many customers does MongoDB have?",
+]
+
+def load_queries(path=None, sample_chunks=0):
+    """Returns evaluation queries from a file (one per line), sampled chunk texts, or the defaults."""
+    if path:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    if sample_chunks:
+        collection = get_mongo_collection("search")
+        return [doc["text"] for doc in collection.aggregate([{"$sample": {"size": sample_chunks}}, {"$project": {"text": 1}}])]
+    return DEFAULT_QUERIES
+
+def run_search(collection, query_embedding, k, num_candidates=None, exact=False):
+    """Runs one vector search and returns (result ids, latency in ms)."""
+    pipeline = [
+        build_vector_search_stage(query_embedding, limit=k, num_candidates=num_candidates, exact=exact),
+        {"$project": {"_id": 1}}
+    ]
+    start = time.perf_counter()
+    ids = [doc["_id"] for doc in collection.aggregate(pipeline)]
+    return ids, (time.perf_counter() - start) * 1000
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def evaluate(queries, k, num_candidates_settings, repeats=1):
+    """Returns one report row for exact search and one per numCandidates setting."""
+    collection = get_mongo_collection("search")
+    embeddings = [project_query_embedding(get_query_embedding(query)) for query in queries]
+
+    exact_ids = []
+    exact_latencies = []
+    for embedding in embeddings:
+        for _ in range(repeats):
+            ids, latency = run_search(collection, embedding, k, exact=True)
+            exact_latencies.append(latency)
+        exact_ids.append(set(ids))
+    rows = [{"setting": "exact", "recall": 1.0, "p50_ms": statistics.median(exact_latencies), "p95_ms": percentile(exact_latencies, 95)}]
+
+    for num_candidates in num_candidates_settings:
+        recalls = []
+        latencies = []
+        for embedding, expected in zip(embeddings, exact_ids):
+            for _ in range(repeats):
+                ids, latency = run_search(collection, embedding, k, num_candidates=num_candidates)
+                latencies.append(latency)
+            recalls.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+        rows.append({
+            "setting": f"ann numCandidates={max(num_candidates, k)}",
+            "recall": statistics.mean(recalls),
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": percentile(latencies, 95)
+        })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=VECTOR_SEARCH_LIMIT, help="results per query (limit)")
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--queries", help="file with one query per line")
+    parser.add_argument("--sample-chunks", type=int, default=0, help="use N random stored chunks as queries")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per query and setting")
+    args = parser.parse_args(argv)
+
+    try:
+        queries = load_queries(args.queries, args.sample_chunks)
+        logger.info(f"Evaluating {len(queries)} queries at k={args.k}...")
+        rows = evaluate(queries, args.k, args.num_candidates, args.repeats)
+    finally:
+        close_mongo_client()
+
+    print(f"\n{'setting':<28}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in rows:
+        print(f"{row['setting']:<28}{row['recall']:>10.3f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
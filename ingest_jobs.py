@@ -0,0 +1,217 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/ingest_jobs.py
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from config import (
+    DB_NAME, COLLECTION_NAME,
+    INGEST_JOBS_COLLECTION, INGEST_LOCKS_COLLECTION, INGEST_LOCK_TTL_SECONDS, INGEST_JOB_UPDATE_SECONDS
+)
+from db_utils import get_mongo_client, ingest_documents_to_mongodb, load_ingest_manifest, normalize_manifest, IngestionCancelled
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class IngestionAlreadyRunning(Exception):
+    """Raised when an ingestion job already holds the lock for the collection."""
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _jobs():
+    return get_mongo_client()[DB_NAME][INGEST_JOBS_COLLECTION]
+
+def _locks():
+    return get_mongo_client()[DB_NAME][INGEST_LOCKS_COLLECTION]
+
+def _acquire_lock(job_id):
+    """Takes the per-collection ingestion lease, or raises IngestionAlreadyRunning."""
+    now = _now()
+    try:
+        # The filter only matches a free or expired lease; otherwise the upsert
+        # collides with the held lease's _id and raises DuplicateKeyError
+        _locks().update_one(
+            {"_id": COLLECTION_NAME, "expires_at": {"$lt": now}},
+            {"$set": {"job_id": job_id, "expires_at": now + datetime.timedelta(seconds=INGEST_LOCK_TTL_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        holder = _locks().find_one({"_id": COLLECTION_NAME}) or {}
+        raise IngestionAlreadyRunning(f"Ingestion job {holder.get('job_id')} is already running for '{COLLECTION_NAME}'.")
+
+def _renew_lock(job_id):
+    expires_at = _now() + datetime.timedelta(seconds=INGEST_LOCK_TTL_SECONDS)
+    _locks().update_one({"_id": COLLECTION_NAME, "job_id": job_id}, {"$set": {"expires_at": expires_at}})
+
+def _release_lock(job_id):
+    _locks().delete_one({"_id": COLLECTION_NAME, "job_id": job_id})
+
+class IngestJob:
+    """
+    One background ingestion run. Progress is kept in memory and persisted to
+    the jobs collection by a heartbeat thread, which also renews the collection
+    lease and picks up cancellation requested from any worker.
+    """
+    def __init__(self, job_id, sources, wait_for_index=False):
+        self.job_id = job_id
+        self.sources = sources
+        self.wait_for_index = wait_for_index
+        self.stage = "queued"
+        self.chunks_done = 0
+        self.chunks_total = None
+        self.started_at = None
+        self.cancel_event = threading.Event()
+        self._finished = threading.Event()
+
+    def _on_progress(self, done, total):
+        self.chunks_done = done
+        self.chunks_total = total
+
+    def _on_stage(self, stage):
+        self.stage = stage
+        self._persist()
+
+    def _progress_fields(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        throughput = self.chunks_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.chunks_total and throughput > 0:
+            eta = max(self.chunks_total - self.chunks_done, 0) / throughput
+        return {
+            "stage": self.stage,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "chunks_per_second": throughput,
+            "eta_seconds": eta,
+            "updated_at": _now()
+        }
+
+    def _persist(self, **fields):
+        try:
+            _jobs().update_one({"_id": self.job_id}, {"$set": {**self._progress_fields(), **fields}})
+        except Exception as e:
+            logger.error(f"Error updating ingestion job {self.job_id}: {e}")
+
+    def _heartbeat(self):
+        while not self._finished.wait(INGEST_JOB_UPDATE_SECONDS):
+            try:
+                _renew_lock(self.job_id)
+                job = _jobs().find_one({"_id": self.job_id}, {"cancel_requested": 1})
+                if job and job.get("cancel_requested"):
+                    self.cancel_event.set()
+            except Exception as e:
+                logger.error(f"Ingestion job {self.job_id} heartbeat failed: {e}")
+            self._persist()
+
+    def _cancel_requested(self):
+        if self.cancel_event.is_set():
+            return True
+        try:
+            job = _jobs().find_one({"_id": self.job_id}, {"cancel_requested": 1})
+            return bool(job and job.get("cancel_requested"))
+        except Exception as e:
+            logger.error(f"Error reading ingestion job {self.job_id}: {e}")
+            return False
+
+    def run(self):
+        """Runs the ingestion and records the outcome; the lease is always released."""
+        self.started_at = time.monotonic()
+        heartbeat = threading.Thread(target=self._heartbeat, name=f"ingest-heartbeat-{self.job_id}", daemon=True)
+        heartbeat.start()
+        try:
+            result = ingest_documents_to_mongodb(
+                self.sources,
+                progress_callback=self._on_progress,
+                stage_callback=self._on_stage,
+                cancel_event=self.cancel_event,
+                wait_for_index=self.wait_for_index
+            )
+            self.stage = "completed"
+            fields = {}
+            if self._cancel_requested():
+                # Requested after the last cancellation point; say so rather than claim it worked
+                fields["cancel_honoured"] = False
+                logger.warning(f"Ingestion job {self.job_id} finished before its cancellation took effect.")
+            self._persist(status="completed", result=result, finished_at=_now(), **fields)
+            logger.info(f"Ingestion job {self.job_id} completed: {result}")
+        except IngestionCancelled:
+            self.stage = "cancelled"
+            self._persist(status="cancelled", finished_at=_now())
+        except Exception as e:
+            logger.exception(f"Ingestion job {self.job_id} failed.")
+            self.stage = "failed"
+            self._persist(status="failed", error=str(e), finished_at=_now())
+        finally:
+            self._finished.set()
+            heartbeat.join()
+            _release_lock(self.job_id)
+
+def _create_job(sources, wait_for_index=False):
+    """Takes the collection lease and records a new job; returns the IngestJob."""
+    # Validate before taking the lease, so a bad manifest fails the request
+    sources = load_ingest_manifest() if sources is None else normalize_manifest(sources)
+    if not sources:
+        raise ValueError("No documents to ingest.")
+    job_id = uuid.uuid4().hex
+    _acquire_lock(job_id)
+    try:
+        _jobs().insert_one({
+            "_id": job_id,
+            "collection": COLLECTION_NAME,
+            "sources": [entry["url"] for entry in sources],
+            "status": "running",
+            "stage": "queued",
+            "cancel_requested": False,
+            "created_at": _now()
+        })
+    except Exception:
+        _release_lock(job_id)
+        raise
+    return IngestJob(job_id, sources, wait_for_index=wait_for_index)
+
+def start_ingest_job(sources=None) -> str:
+    """
+    Starts ingestion of sources (see db_utils.normalize_manifest(); default:
+    the configured manifest) in a background thread and returns its job id.
+    Raises IngestionAlreadyRunning if another job holds the collection's lease.
+    """
+    job = _create_job(sources)
+    try:
+        threading.Thread(target=job.run, name=f"ingest-{job.job_id}", daemon=True).start()
+    except Exception:
+        _release_lock(job.job_id)
+        raise
+    logger.info(f"Started ingestion job {job.job_id} for {len(job.sources)} documents.")
+    return job.job_id
+
+def run_ingest_job(sources=None, wait_for_index=False):
+    """
+    Runs an ingestion job in the calling thread, under the same lease as
+    start_ingest_job(), and returns its final status document.
+    """
+    job = _create_job(sources, wait_for_index=wait_for_index)
+    logger.info(f"Running ingestion job {job.job_id} for {len(job.sources)} documents.")
+    job.run()
+    return get_ingest_job(job.job_id)
+
+def get_ingest_job(job_id: str):
+    """Returns the job's status document, or None if it does not exist."""
+    job = _jobs().find_one({"_id": job_id})
+    if job:
+        job["job_id"] = job.pop("_id")
+        updated_at = job.get("updated_at") or job.get("created_at")
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=datetime.timezone.utc)
+        # A running job that stopped heartbeating died with its worker
+        if job["status"] == "running" and _now() - updated_at > datetime.timedelta(seconds=INGEST_LOCK_TTL_SECONDS):
+            job["status"] = "abandoned"
+    return job
+
+def cancel_ingest_job(job_id: str) -> bool:
+    """Requests cancellation of a running job; returns False if it is unknown or already finished."""
+    result = _jobs().update_one({"_id": job_id, "status": "running"}, {"$set": {"cancel_requested": True}})
+    return result.matched_count == 1
@@ -0,0 +1,298 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/local_vector_store.py
+import datetime
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from bson_vectors import decode_vector
+from config import LOCAL_INDEX_PATH, LOCAL_INDEX_CHECK_INTERVAL_SECONDS, VECTOR_SEARCH_LIMIT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "snapshot.json"
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+_local_vector_store = None
+_local_vector_store_lock = threading.Lock()
+
+def _epoch_seconds(value):
+    """Seconds since the epoch for a datetime; naive datetimes are UTC, as pymongo returns them."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+def _metadata_arrays(manifest):
+    """Per-row filter fields as NumPy arrays; missing values never match a filter."""
+    rows = manifest["rows"]
+
+    def numbers(values):
+        return np.asarray([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    return {
+        "sources": np.asarray(manifest.get("sources") or [None] * rows, dtype=object),
+        "urls": np.asarray(manifest.get("urls") or [None] * rows, dtype=object),
+        "page_labels": np.asarray([str(page) for page in manifest["page_numbers"]], dtype=object),
+        "pdf_pages": numbers(manifest.get("pdf_pages") or [None] * rows),
+        "ingested_at": numbers(manifest.get("ingested_at") or [None] * rows)
+    }
+
+def filter_mask(metadata, search_filter):
+    """Boolean row mask for a metadata filter (same keys as db_utils.build_search_filter()), or None."""
+    if not search_filter:
+        return None
+    mask = np.ones(len(metadata["sources"]), dtype=bool)
+    if search_filter.get("source"):
+        mask &= metadata["sources"] == search_filter["source"]
+    if search_filter.get("url"):
+        mask &= metadata["urls"] == search_filter["url"]
+    if search_filter.get("page_numbers"):
+        mask &= np.isin(metadata["page_labels"], [str(page) for page in search_filter["page_numbers"]])
+    # NaN (missing) compares False, so chunks without the field are excluded
+    if search_filter.get("page_from") is not None:
+        mask &= metadata["pdf_pages"] >= search_filter["page_from"]
+    if search_filter.get("page_to") is not None:
+        mask &= metadata["pdf_pages"] <= search_filter["page_to"]
+    if search_filter.get("ingested_after") is not None:
+        mask &= metadata["ingested_at"] >= _epoch_seconds(search_filter["ingested_after"])
+    if search_filter.get("ingested_before") is not None:
+        mask &= metadata["ingested_at"] <= _epoch_seconds(search_filter["ingested_before"])
+    return mask
+
+def _result(i, vectors, texts, page_numbers, metadata):
+    """One search result in the shape the Atlas pipelines project."""
+    return {
+        "text": texts[i],
+        "page_number": page_numbers[i],
+        "source": metadata["sources"][i],
+        "url": metadata["urls"][i],
+        "embedding": vectors[i]
+    }
+
+def build_snapshot(collection, path=LOCAL_INDEX_PATH, batch_size=1000, query=None):
+    """
+    Streams text, embedding and the filterable metadata (source, url,
+    page_number, pdf_page, ingested_at) from the collection into a snapshot
+    directory: one contiguous, L2-normalized float32 .npy matrix plus a JSON
+    manifest with the chunk metadata. The manifest is replaced atomically, so
+    readers always see a complete snapshot. query restricts the chunks
+    included, e.g. to those stored under the current projection.
+    """
+    query = query or {}
+    os.makedirs(path, exist_ok=True)
+    expected = collection.count_documents(query)
+    vectors_file = f"vectors-{time.time_ns()}.npy"
+    vectors_path = os.path.join(path, vectors_file)
+    matrix = None
+    texts = []
+    page_numbers = []
+    sources = []
+    urls = []
+    pdf_pages = []
+    ingested_at = []
+
+    fields = {"_id": 0, "text": 1, "page_number": 1, "embedding": 1, "source": 1, "url": 1, "pdf_page": 1, "ingested_at": 1}
+    cursor = collection.find(query, fields, batch_size=batch_size)
+    for doc in cursor:
+        if len(texts) == expected:
+            break
+        vector = decode_vector(doc["embedding"])
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(expected, vector.shape[0]))
+        norm = np.linalg.norm(vector)
+        matrix[len(texts)] = vector / norm if norm else vector
+        texts.append(doc["text"])
+        page_numbers.append(doc.get("page_number"))
+        sources.append(doc.get("source"))
+        urls.append(doc.get("url"))
+        pdf_pages.append(doc.get("pdf_page"))
+        ingested_at.append(_epoch_seconds(doc["ingested_at"]) if doc.get("ingested_at") else None)
+    cursor.close()
+
+    if matrix is None:
+        np.save(vectors_path, np.zeros((0, 0), dtype=np.float32))
+    else:
+        matrix.flush()
+        del matrix
+
+    manifest = {
+        "vectors_file": vectors_file,
+        "rows": len(texts),
+        "created_at": time.time(),
+        "texts": texts,
+        "page_numbers": page_numbers,
+        "sources": sources,
+        "urls": urls,
+        "pdf_pages": pdf_pages,
+        "ingested_at": ingested_at
+    }
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Readers that still map an old matrix keep it alive until they reload
+    for name in os.listdir(path):
+        if name.startswith("vectors-") and name != vectors_file:
+            os.remove(os.path.join(path, name))
+    logger.info(f"Built local vector snapshot with {len(texts)} vectors at {path}.")
+    return len(texts)
+
+def tokenize(text):
+    """Lowercased word tokens used by the BM25 index."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+    Okapi BM25 over chunk texts. Postings are NumPy arrays, so scoring a query
+    is one vectorized update per query term.
+    """
+    def __init__(self, texts, k1=1.2, b=0.75):
+        postings = {}
+        lengths = np.empty(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        self.size = len(texts)
+        self.k1 = k1
+        avg_length = float(lengths.mean()) if self.size else 0.0
+        # Per-document part of the BM25 denominator
+        self._length_norm = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(self.size, k1, dtype=np.float32)
+        self._postings = {}
+        for term, (ids, tfs) in postings.items():
+            idf = math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            self._postings[term] = (idf, np.asarray(ids, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+
+    def search(self, query, limit, mask=None):
+        """
+        Returns the row ids of the best-scoring chunks, best first; chunks
+        sharing no term, or outside the optional boolean mask, are left out.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self._postings:
+                idf, ids, tfs = self._postings[term]
+                scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self._length_norm[ids])
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores)
+        return hits[np.argsort(-scores[hits], kind="stable")[:limit]]
+
+class LocalVectorStore:
+    """
+    In-process vector index over a memory-mapped snapshot. A query is one
+    matrix-vector product plus an argpartition for the top k. The snapshot is
+    re-mapped when its manifest changes on disk. A BM25 index over the same
+    texts serves full-text search; it is built on first use.
+    """
+    def __init__(self, path=LOCAL_INDEX_PATH, check_interval=LOCAL_INDEX_CHECK_INTERVAL_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._manifest_mtime = None
+        self._last_check = 0.0
+        self._vectors = None
+        self._texts = []
+        self._page_numbers = []
+        self._metadata = None
+        self._text_index = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Maps the current snapshot; returns the number of vectors loaded."""
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        mtime = os.path.getmtime(manifest_path)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        vectors = np.load(os.path.join(self.path, manifest["vectors_file"]), mmap_mode="r")[:manifest["rows"]]
+        with self._lock:
+            self._vectors = vectors
+            self._texts = manifest["texts"]
+            self._page_numbers = manifest["page_numbers"]
+            self._metadata = _metadata_arrays(manifest)
+            self._text_index = None
+            self._manifest_mtime = mtime
+            self._last_check = time.monotonic()
+        logger.info(f"Loaded local vector snapshot with {manifest['rows']} vectors.")
+        return manifest["rows"]
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            if os.path.getmtime(os.path.join(self.path, MANIFEST_FILE)) != self._manifest_mtime:
+                self.reload()
+        except OSError as e:
+            logger.error(f"Error checking local vector snapshot: {e}")
+
+    def search(self, query_embedding, limit=None, search_filter=None):
+        """
+        Returns the top-k chunks as dicts with text, page_number, source, url
+        and embedding, best first. With search_filter only the matching rows are scored.
+        """
+        self._reload_if_changed()
+        limit = limit or VECTOR_SEARCH_LIMIT
+        with self._lock:
+            vectors, texts, page_numbers, metadata = self._vectors, self._texts, self._page_numbers, self._metadata
+        if vectors is None or not len(texts):
+            return []
+        mask = filter_mask(metadata, search_filter)
+        rows = np.arange(len(texts)) if mask is None else np.flatnonzero(mask)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = (vectors if mask is None else vectors[rows]) @ (query / norm if norm else query)
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = rows[top[np.argsort(-scores[top])]]
+        return [_result(i, vectors, texts, page_numbers, metadata) for i in top]
+
+    def text_search(self, query, limit=None, search_filter=None):
+        """Returns the top-k chunks by BM25 score, in the same shape as search(), best first."""
+        self._reload_if_changed()
+        limit = limit or VECTOR_SEARCH_LIMIT
+        with self._lock:
+            if self._text_index is None:
+                self._text_index = BM25Index(self._texts)
+            text_index, vectors, texts, page_numbers = self._text_index, self._vectors, self._texts, self._page_numbers
+            metadata = self._metadata
+        hits = text_index.search(query, limit, filter_mask(metadata, search_filter))
+        return [_result(i, vectors, texts, page_numbers, metadata) for i in hits]
+
+def get_local_vector_store():
+    """Returns the process-wide local vector store, loading the snapshot on first use."""
+    global _local_vector_store
+    if _local_vector_store is None:
+        with _local_vector_store_lock:
+            if _local_vector_store is None:
+                _local_vector_store = LocalVectorStore()
+    return _local_vector_store
+
+def reload_local_vector_store():
+    """Re-maps the snapshot in this process if the store has been loaded."""
+    if _local_vector_store is not None:
+        _local_vector_store.reload()
+
+if __name__ == "__main__":
+    # Build a snapshot from the collection, e.g. before working offline
+    from db_utils import close_mongo_client, get_mongo_collection
+    from embedding_projection import current_projection_id
+    try:
+        build_snapshot(get_mongo_collection("search"), query={"projection": current_projection_id()})
+    finally:
+        close_mongo_client()
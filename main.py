@@ -1,21 +1,82 @@
 # RAG WITH ATLAS VECTOR SEARCH/backend/main.py
+import time
+_import_started = time.perf_counter()  # start of the cold-start clock
+
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from rag_chain import answer_question # Import your RAG function
-from db_utils import ingest_documents_to_mongodb # For initial ingestion
+from rag_chain import aanswer_question, aanswer_questions, astream_answer # Import your RAG function
+from ingest_jobs import start_ingest_job, get_ingest_job, cancel_ingest_job, IngestionAlreadyRunning # For initial ingestion
+from db_utils import get_mongo_client, close_mongo_client, get_async_mongo_client, close_async_mongo_client
+from db_utils import get_vector_index_status
+from pdf_parsing import close_pdf_parse_pool
 import logging
 import sys
 import datetime
-from config import MONGO_URI
+import json
+import urllib.parse
+from typing import List, Optional
+from config import MONGO_URI, BATCH_MAX_QUERIES
+from embedding_cache import get_embedding_cache, get_query_embedding_cache, get_rerank_score_cache
+from semantic_cache import get_answer_cache, invalidate_answer_cache
+from metrics import get_metric, metrics_snapshot
+from rag_models import warm_up_models
+from embedding_projection import get_embedding_projection
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+async def warm_up(app: FastAPI):
+    """Loads and warms up the models off the event loop, then marks the app ready."""
+    try:
+        await asyncio.to_thread(warm_up_models)
+        app.state.ready = True
+        cold_start = time.perf_counter() - _import_started
+        get_metric("cold_start_ms").record(cold_start * 1000)
+        logger.info(f"Ready to serve {cold_start:.1f}s after import.")
+    except Exception as e:
+        logger.error(f"Model warm-up failed: {e}")
+
+async def connect_mongo():
+    """Opens the shared MongoDB clients and loads the projection without holding up startup."""
+    try:
+        # Async client serves requests; the sync client is used by ingestion
+        await get_async_mongo_client()
+        await asyncio.to_thread(get_mongo_client)
+    except Exception as e:
+        # Keep serving; the clients are retried lazily and /health reports the failure
+        logger.error(f"MongoDB connection failed at startup: {e}")
+        return
+    try:
+        # Load a fitted projection now rather than on the first request
+        await asyncio.to_thread(get_embedding_projection)
+    except Exception as e:
+        logger.warning(f"Embedding projection not loaded at startup: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts model warm-up and the MongoDB connection in the background on startup;
+    closes the clients on shutdown. /ready reports 503 until warm-up has finished.
+    """
+    app.state.ready = False
+    warm_up_task = asyncio.create_task(warm_up(app))
+    connect_task = asyncio.create_task(connect_mongo())
+    yield
+    warm_up_task.cancel()
+    connect_task.cancel()
+    await asyncio.to_thread(close_pdf_parse_pool)
+    await close_async_mongo_client()
+    close_mongo_client()
+
 app = FastAPI(
     title="MongoDB Investor RAG API",
     description="API for Retrieval Augmented Generation using MongoDB Investor Relations documents.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Configure CORS to allow your frontend to access the API
@@ -34,8 +95,35 @@ app.add_middleware(
     allow_headers=["*"], # Allows all headers
 )
 
+class SearchFilter(BaseModel):
+    """Optional metadata filter applied inside the vector index before ranking."""
+    source: Optional[str] = None
+    url: Optional[str] = None
+    page_numbers: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    ingested_after: Optional[datetime.datetime] = None
+    ingested_before: Optional[datetime.datetime] = None
+
 class QueryRequest(BaseModel):
     query: str
+    filter: Optional[SearchFilter] = None
+
+def _search_filter(request: QueryRequest):
+    """The request's filter as the dict retrieval expects, or None."""
+    if request.filter is None:
+        return None
+    return request.filter.model_dump(exclude_none=True) or None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+
+class IngestSource(BaseModel):
+    url: str
+    source: Optional[str] = None
+
+class IngestRequest(BaseModel):
+    sources: List[IngestSource]
 
 print(f"[DEBUG] Python version: {sys.version}")
 print(f"[DEBUG] MONGO_URI: {MONGO_URI}")
@@ -46,18 +134,28 @@ async def read_root():
     logger.info("Root endpoint accessed.")
     return {"message": "RAG API is running!", "status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the models are loaded and warmed up, 503 before."""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"ready": False, "status": "warming up"})
+    return {"ready": True}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for deployment monitoring."""
     try:
-        # Test MongoDB connection
-        from db_utils import get_mongo_collection
-        collection = get_mongo_collection()
-        collection.find_one()  # Simple query to test connection
+        # Test MongoDB connection over the shared pool
+        client = await get_async_mongo_client()
+        await client.admin.command('ping')
+        vector_index = await asyncio.to_thread(get_vector_index_status)
+        index_state = "index building" if vector_index["status"] in ("PENDING", "BUILDING") else vector_index["status"].lower()
 
         return {
             "status": "healthy",
             "mongodb": "connected",
+            "vector_index": index_state,
+            "ready": app.state.ready,
             "timestamp": str(datetime.datetime.now())
         }
     except Exception as e:
@@ -68,6 +166,27 @@ async def health_check():
             "timestamp": str(datetime.datetime.now())
         }
 
+@app.get("/stats")
+async def stats():
+    """Cache and performance counters for this worker."""
+    embedding_cache = get_embedding_cache()
+    query_embedding_cache = get_query_embedding_cache()
+    answer_cache = get_answer_cache()
+    rerank_score_cache = get_rerank_score_cache()
+    return {
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "query_embedding_cache": query_embedding_cache.stats() if query_embedding_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "rerank_score_cache": rerank_score_cache.stats() if rerank_score_cache else None,
+        "metrics": metrics_snapshot()
+    }
+
+@app.post("/cache/invalidate")
+async def invalidate_cache():
+    """Drops every worker's cached answers, e.g. after the corpus was changed out of band."""
+    await asyncio.to_thread(invalidate_answer_cache)
+    return {"message": "Answer cache invalidated."}
+
 @app.post("/ask")
 async def ask_rag(request: QueryRequest):
     """
@@ -78,12 +197,35 @@ async def ask_rag(request: QueryRequest):
 
     logger.info(f"Received query: '{request.query}'")
     try:
-        response = answer_question(request.query)
+        response = await aanswer_question(request.query, search_filter=_search_filter(request))
         return response
     except Exception as e:
         logger.exception("Error processing RAG query in API.") # Logs full traceback
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
 
+@app.post("/ask/batch")
+async def ask_rag_batch(request: BatchQueryRequest):
+    """
+    Answers a list of questions in one call. Results come back in input order;
+    a failed query has an "error" entry instead of "answer" and "sources".
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Queries cannot be empty.")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+
+    logger.info(f"Received batch of {len(request.queries)} queries")
+    valid = [(i, query) for i, query in enumerate(request.queries) if query]
+    results = [{"query": query, "error": "Query cannot be empty."} for query in request.queries]
+    try:
+        answers = await aanswer_questions([query for _, query in valid])
+    except Exception as e:
+        logger.exception("Error processing batch RAG query in API.")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+    for (i, _), answer in zip(valid, answers):
+        results[i] = answer
+    return {"results": results}
+
 @app.post("/api/chat")
 async def chat_endpoint(request: QueryRequest):
     """
@@ -94,7 +236,7 @@ async def chat_endpoint(request: QueryRequest):
 
     logger.info(f"Received chat query: '{request.query}'")
     try:
-        response = answer_question(request.query)
+        response = await aanswer_question(request.query, search_filter=_search_filter(request))
 
         # Format response for frontend
         return {
@@ -105,21 +247,69 @@ async def chat_endpoint(request: QueryRequest):
         logger.exception("Error processing chat query in API.")
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
 
-@app.post("/ingest_documents")
-async def ingest_documents_endpoint():
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: QueryRequest):
+    """
+    Streaming chat endpoint (server-sent events). Sends a 'sources' event first,
+    then 'token' events as the LLM generates, then 'done' (or 'error').
+    """
+    if not request.query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty.")
+
+    logger.info(f"Received streaming chat query: '{request.query}'")
+
+    async def event_stream():
+        async for event, data in astream_answer(request.query, search_filter=_search_filter(request)):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so tokens reach the client as they are sent
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/ingest_documents", status_code=202)
+async def ingest_documents_endpoint(request: Optional[IngestRequest] = None):
     """
-    Endpoint to trigger the ingestion of the specified PDF document into MongoDB.
-    This should typically be run once or on demand, not continuously.
+    Endpoint to trigger the ingestion of PDF documents into MongoDB: the listed
+    sources, or the configured manifest when the body is empty. Ingestion runs
+    as a background job; poll /ingest_documents/{job_id} for progress. Only
+    one ingestion per collection runs at a time.
     """
     logger.info("Received request to ingest documents via API.")
+    sources = [source.model_dump(exclude_none=True) for source in request.sources] if request else None
+    # Local paths are only read from the operator's INGEST_MANIFEST_PATH manifest
+    for source in sources or []:
+        if urllib.parse.urlparse(source["url"]).scheme not in ("http", "https"):
+            raise HTTPException(status_code=400, detail=f"Source URLs must be http(s): {source['url']!r}")
     try:
         # In a production app, you would add authentication/authorization to this endpoint
         # to prevent unauthorized document ingestion.
-        ingest_documents_to_mongodb()
-        logger.info("Document ingestion process initiated successfully via API.")
-        return {"message": "Document ingestion initiated. Check backend logs for progress."}
+        job_id = await asyncio.to_thread(start_ingest_job, sources)
+        logger.info(f"Document ingestion job {job_id} started via API.")
+        return {"message": "Document ingestion started.", "job_id": job_id}
+    except IngestionAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.exception("Error during document ingestion via API.")
+        logger.exception("Error starting document ingestion via API.")
         raise HTTPException(status_code=500, detail=f"Document ingestion failed: {e}")
 
+@app.get("/ingest_documents/{job_id}")
+async def ingest_status_endpoint(job_id: str):
+    """Reports an ingestion job's stage, chunks done/total, throughput and ETA."""
+    job = await asyncio.to_thread(get_ingest_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Ingestion job {job_id} not found.")
+    return job
+
+@app.post("/ingest_documents/{job_id}/cancel")
+async def ingest_cancel_endpoint(job_id: str):
+    """Requests cancellation of a running ingestion job."""
+    if not await asyncio.to_thread(cancel_ingest_job, job_id):
+        raise HTTPException(status_code=404, detail=f"No running ingestion job {job_id}.")
+    return {"message": "Cancellation requested.", "job_id": job_id}
+
 # You can add more endpoints here, e.g., for document upload, system status, etc.
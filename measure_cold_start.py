@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Measures the serving app's import time and cold start (import plus model
+warm-up) against the budgets in config.py, and lists the slowest imports.
+Exits non-zero when a budget is exceeded.
+
+Usage:
+    python measure_cold_start.py
+    python measure_cold_start.py --skip-warmup --top 20
+"""
+import argparse
+import subprocess
+import sys
+
+from config import IMPORT_TIME_BUDGET_SECONDS, COLD_START_BUDGET_SECONDS
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+if {warm_up}:
+    from rag_models import warm_up_models
+    warm_up_models()
+print(f"{{imported - start}} {{time.perf_counter() - start}}")
+"""
+
+def slowest_imports(stderr, top):
+    """Parses `python -X importtime` output into the top (cumulative seconds, module) pairs."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that triggered them
+        rows.append((int(cumulative) / 1e6, module[1:]))
+    top_level = [(seconds, module) for seconds, module in rows if not module.startswith(" ")]
+    return sorted(top_level, reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skip-warmup", action="store_true", help="measure import time only")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args(argv)
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(warm_up=not args.skip_warmup)],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        return result.returncode
+    import_seconds, total_seconds = map(float, result.stdout.strip().splitlines()[-1].split())
+
+    print("Slowest imports (cumulative):")
+    for seconds, module in slowest_imports(result.stderr, args.top):
+        print(f"  {seconds:8.3f}s  {module}")
+
+    failed = False
+    print(f"\nImport time: {import_seconds:.2f}s (budget {IMPORT_TIME_BUDGET_SECONDS:.2f}s)")
+    failed |= import_seconds > IMPORT_TIME_BUDGET_SECONDS
+    if not args.skip_warmup:
+        print(f"Cold start:  {total_seconds:.2f}s (budget {COLD_START_BUDGET_SECONDS:.2f}s)")
+        failed |= total_seconds > COLD_START_BUDGET_SECONDS
+    print("Over budget." if failed else "Within budget.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
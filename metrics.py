@@ -0,0 +1,51 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/metrics.py
+import threading
+from collections import deque
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+class RollingStats:
+    """Thread-safe summary (count, mean, percentiles) over the most recent observations."""
+    def __init__(self, window=1000):
+        self.count = 0
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        """Adds one observation."""
+        with self._lock:
+            self.count += 1
+            self._values.append(value)
+
+    def snapshot(self):
+        """Returns the total count and mean/p50/p95/max over the window."""
+        with self._lock:
+            values = sorted(self._values)
+            count = self.count
+        if not values:
+            return {"count": count}
+
+        def percentile(pct):
+            return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+        return {
+            "count": count,
+            "mean": sum(values) / len(values),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "max": values[-1]
+        }
+
+def get_metric(name):
+    """Returns the named RollingStats, creating it on first use."""
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = RollingStats()
+        return _metrics[name]
+
+def metrics_snapshot():
+    """Returns a snapshot of every registered metric, keyed by name."""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {name: stats.snapshot() for name, stats in sorted(metrics.items())}
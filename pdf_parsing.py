@@ -0,0 +1,125 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/pdf_parsing.py
+import collections
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import PDF_PARSE_WORKERS, PDF_PARSE_PAGES_PER_TASK
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pool workers import this module, so heavy imports stay inside functions
+_pdf_parse_pool = None
+_pdf_parse_pool_lock = threading.Lock()
+
+def _extract_page_range(path, start, stop):
+    """Extracts the text of pages [start, stop) of a local PDF (runs in a pool worker)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    # Same extraction PyPDFLoader performs for each page
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+def get_pdf_parse_pool():
+    """
+    Returns the process pool shared by all ingestion pipelines, or None when
+    PDF_PARSE_WORKERS is 1. Workers are spawned rather than forked, since the
+    parent runs threads and holds open MongoDB connections.
+    """
+    global _pdf_parse_pool
+    if PDF_PARSE_WORKERS <= 1:
+        return None
+    if _pdf_parse_pool is None:
+        with _pdf_parse_pool_lock:
+            if _pdf_parse_pool is None:
+                _pdf_parse_pool = ProcessPoolExecutor(
+                    max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"Started PDF parsing pool with {PDF_PARSE_WORKERS} workers.")
+    return _pdf_parse_pool
+
+def close_pdf_parse_pool():
+    """Shuts the pool down; the next ingestion starts a new one."""
+    global _pdf_parse_pool
+    with _pdf_parse_pool_lock:
+        if _pdf_parse_pool is not None:
+            _pdf_parse_pool.shutdown(cancel_futures=True)
+            _pdf_parse_pool = None
+
+def _download_pdf(url):
+    """Downloads a remote PDF to a temporary file and returns its path."""
+    import requests
+
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            for block in response.iter_content(chunk_size=1 << 20):
+                f.write(block)
+    return f.name
+
+def iter_pdf_pages(pdf_url, pages_per_task=PDF_PARSE_PAGES_PER_TASK):
+    """
+    Yields a PDF's pages in order as LangChain Documents with the metadata
+    PyPDFLoader sets (source, page, page_label, total_pages). Text extraction
+    is split into ranges of pages_per_task pages that run across the process
+    pool; up to two ranges per worker are in flight, so pages stream into
+    chunking while later ranges are still being extracted. Without a pool the
+    pages are loaded by PyPDFLoader in the calling thread.
+    """
+    from langchain_core.documents import Document
+
+    pool = get_pdf_parse_pool()
+    if pool is None:
+        from langchain_community.document_loaders import PyPDFLoader
+
+        yield from PyPDFLoader(pdf_url).lazy_load()
+        return
+
+    from pypdf import PdfReader
+
+    remote = urllib.parse.urlparse(pdf_url).scheme in ("http", "https")
+    path = _download_pdf(pdf_url) if remote else pdf_url
+    pending = collections.deque()
+    try:
+        reader = PdfReader(path)
+        total_pages = len(reader.pages)
+        # Computed once here; each page's label depends on the whole label tree
+        page_labels = reader.page_labels
+        ranges = iter([(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)])
+
+        def submit_next():
+            page_range = next(ranges, None)
+            if page_range:
+                pending.append((page_range[0], pool.submit(_extract_page_range, path, *page_range)))
+
+        for _ in range(2 * PDF_PARSE_WORKERS):
+            submit_next()
+        while pending:
+            start, future = pending.popleft()
+            texts = future.result()
+            submit_next()
+            for i, text in enumerate(texts, start=start):
+                yield Document(page_content=text, metadata={
+                    "source": pdf_url,
+                    "total_pages": total_pages,
+                    "page": i,
+                    "page_label": page_labels[i]
+                })
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        close_pdf_parse_pool()
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if remote:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
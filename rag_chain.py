@@ -1,16 +1,30 @@
 # RAG WITH ATLAS VECTOR SEARCH/backend/rag_chain.py
-from db_utils import get_query_results
-from rag_models import get_llm_client
-from config import INVESTOR_PDF_URL
+from db_utils import get_query_results, aget_query_results, default_source_name
+from rag_models import get_llm_client, get_async_llm_client, get_query_embedding, aget_query_embedding
+from rag_models import get_query_embeddings, aget_query_embeddings
+from rag_models import get_reranker_model, normalize_query, run_in_embedding_executor
+from semantic_cache import get_answer_cache
+from embedding_cache import get_rerank_score_cache
+from config import INVESTOR_PDF_URL, BATCH_LLM_CONCURRENCY
+from config import RERANK_ENABLED, RERANK_CANDIDATES, RERANK_TOP_K, RERANK_LATENCY_BUDGET_MS
+from config import DEDUP_SIMILARITY_THRESHOLD, MMR_LAMBDA, MMR_FETCH_K, VECTOR_SEARCH_LIMIT
+from bson_vectors import decode_vector
+from embedding_projection import project_query_embedding, aproject_query_embedding
+from metrics import get_metric
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import hashlib
 import logging
+import time
+
+import numpy as np
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def deduplicate_sources(sources, similarity_threshold=0.8):
-    """
-    Remove duplicate or very similar sources based on text content.
-    """
+def _deduplicate_by_prefix(sources):
+    """Drops sources whose first 100 normalized characters were already seen."""
     unique_sources = []
     seen_texts = set()
 
@@ -24,65 +38,384 @@ def deduplicate_sources(sources, similarity_threshold=0.8):
 
     return unique_sources
 
-def answer_question(query: str) -> dict:
+def deduplicate_sources(sources, similarity_threshold=DEDUP_SIMILARITY_THRESHOLD, query_embedding=None, diversity=MMR_LAMBDA,
+                        k=None):
     """
-    Performs RAG on the given query using the same approach as the notebook.
-    Returns the answer and source documents.
+    Remove duplicate or very similar sources, ordering the rest by maximal
+    marginal relevance. Uses the embeddings retrieval returned with each chunk
+    and one similarity matrix per request: chunks are picked greedily by
+    diversity * relevance - (1 - diversity) * (max similarity to the picked
+    chunks), and a chunk at least similarity_threshold similar to a picked
+    one is dropped. Relevance is cosine similarity to query_embedding (in the
+    stored vector space) or, without it, the retrieval order. At most k
+    sources are kept, so over-fetched candidates replace dropped duplicates.
+    Sources without embeddings fall back to comparing their first 100 characters.
     """
-    logger.info(f"Processing query: '{query}'")
+    if any(source.get("embedding") is None for source in sources):
+        return _deduplicate_by_prefix(sources)[:k]
+    if len(sources) < 2:
+        return list(sources)
 
-    try:
-        # Get relevant documents using vector search (from notebook)
-        context_docs = get_query_results(query)
+    vectors = np.stack([decode_vector(source["embedding"]) for source in sources])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+    if query_embedding is not None and len(query_embedding) == vectors.shape[1]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = vectors @ (query / (np.linalg.norm(query) or 1))
+    else:
+        # Rank-based relevance on the same 0..1 scale as cosine similarity
+        relevance = 1 - np.arange(len(sources)) / len(sources)
+
+    selected = []
+    remaining = np.ones(len(sources), dtype=bool)
+    max_similarity = np.zeros(len(sources), dtype=np.float32)
+    while remaining.any() and (k is None or len(selected) < k):
+        scores = np.where(remaining, diversity * relevance - (1 - diversity) * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        remaining[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        remaining &= max_similarity < similarity_threshold
+    return [sources[i] for i in selected]
+
+def _dedup_query_embedding(query_embedding):
+    """Query vector for MMR relevance; None after reranking, whose order is the better signal."""
+    return None if RERANK_ENABLED else project_query_embedding(query_embedding)
+
+async def _adedup_query_embedding(query_embedding):
+    """Async counterpart of _dedup_query_embedding()."""
+    return None if RERANK_ENABLED else await aproject_query_embedding(query_embedding)
+
+def _context_size():
+    """Number of chunks that go into the prompt."""
+    return RERANK_TOP_K if RERANK_ENABLED else VECTOR_SEARCH_LIMIT
 
-        # Deduplicate sources to avoid showing similar chunks
-        context_docs = deduplicate_sources(context_docs)
+def _mmr_candidates():
+    """Candidates MMR picks the context from: an over-fetch of the context size."""
+    return max(MMR_FETCH_K, _context_size())
 
-        context_string = " ".join([doc["text"] for doc in context_docs])
+def _retrieval_limit():
+    """Number of chunks to retrieve: the reranker's candidate pool, or MMR's candidates."""
+    return RERANK_CANDIDATES if RERANK_ENABLED else _mmr_candidates()
 
-        # Construct prompt for the LLM using the retrieved documents as context (from notebook)
-        prompt = f"""Use the following pieces of context to answer the question at the end.
+def rerank_documents(query, docs, retrieval_ms=0.0, top_k=RERANK_TOP_K):
+    """
+    Reorders retrieved chunks by cross-encoder relevance to the query and keeps
+    the best top_k. Scores are cached per (query, chunk); uncached pairs are
+    scored in one batched call. If retrieval already took longer than
+    RERANK_LATENCY_BUDGET_MS, or the model is unavailable, the first top_k
+    chunks are kept in retrieval order. A no-op when reranking is disabled.
+    """
+    if not RERANK_ENABLED:
+        return docs
+    if retrieval_ms > RERANK_LATENCY_BUDGET_MS:
+        get_metric("rerank_skipped_retrieval_ms").record(retrieval_ms)
+        return docs[:top_k]
+    model = get_reranker_model()
+    if not model:
+        return docs[:top_k]
+
+    start = time.perf_counter()
+    # The cross-encoder is uncased, so scoring the normalized query keeps cache hits consistent
+    normalized = normalize_query(query)
+    cache = get_rerank_score_cache()
+    keys = [(normalized, hashlib.sha1(doc["text"].encode("utf-8")).hexdigest()) for doc in docs]
+    scores = [cache.get(key) if cache else None for key in keys]
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        predicted = model.predict([(normalized, docs[i]["text"]) for i in missing], batch_size=len(missing))
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+            if cache:
+                cache.put(keys[i], scores[i])
+    get_metric("rerank_ms").record((time.perf_counter() - start) * 1000)
+    ranked = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_k]
+    return [docs[i] for i in ranked]
+
+async def arerank_documents(query, docs, retrieval_ms=0.0, top_k=RERANK_TOP_K):
+    """Async counterpart of rerank_documents(); scoring runs on the bounded embedding pool."""
+    if not RERANK_ENABLED:
+        return docs
+    return await run_in_embedding_executor(rerank_documents, query, docs, retrieval_ms, top_k)
+
+def build_prompt(query, context_docs):
+    """Constructs the LLM prompt using the retrieved documents as context (from notebook)."""
+    context_string = " ".join([doc["text"] for doc in context_docs])
+    return f"""Use the following pieces of context to answer the question at the end.
         {context_string}
         Question: {query}
         """
 
-        # Use Hugging Face InferenceClient (from notebook)
-        llm = get_llm_client()
-        if not llm:
-            logger.error("LLM client not available")
-            return {"answer": "LLM not available. Please check backend logs.", "sources": []}
+def format_answer(answer):
+    """Formats the answer for readability (add newlines after colons if present)."""
+    if answer:
+        # Add a newline after each colon+space for better display
+        answer = answer.replace(': ', ':\n')
+    return answer
+
+def format_sources(context_docs):
+    """Formats sources with their document name, page number and link."""
+    sources = []
+    for doc in context_docs:
+        source, url = doc.get("source"), doc.get("url")
+        if not url:
+            # Chunks stored before per-document metadata kept the URL in 'source'
+            url = source or INVESTOR_PDF_URL
+            source = default_source_name(url)
+        sources.append({
+            "page_content": doc["text"],
+            "metadata": {
+                "source": source,
+                "page_number": doc.get("page_number", None),
+                "url": url
+            }
+        })
+    return sources
+
+class AnswerFormatter:
+    """
+    Applies format_answer() incrementally to streamed tokens. A trailing colon
+    is held back until the next token shows whether a space follows it, so the
+    concatenated output equals format_answer() of the full answer.
+    """
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text):
+        """Returns the formatted text that can be emitted for this token."""
+        text = self._pending + text
+        self._pending = ""
+        if text.endswith(":"):
+            text, self._pending = text[:-1], ":"
+        return format_answer(text)
+
+    def flush(self):
+        """Returns any held-back text at the end of the stream."""
+        text, self._pending = self._pending, ""
+        return text
+
+def _answer_with_embedding(query, query_embedding, search_filter=None):
+    """Answers one query given its embedding; exceptions propagate to the caller."""
+    # Cached answers were built from unfiltered retrieval
+    answer_cache = None if search_filter else get_answer_cache()
+    if answer_cache:
+        cached = answer_cache.get(query_embedding)
+        if cached is not None:
+            return cached
+
+    # Get relevant documents using vector search (from notebook)
+    retrieval_start = time.perf_counter()
+    context_docs = get_query_results(query, query_embedding=query_embedding, limit=_retrieval_limit(), search_filter=search_filter)
+    retrieval_ms = (time.perf_counter() - retrieval_start) * 1000
+    context_docs = rerank_documents(query, context_docs, retrieval_ms, _mmr_candidates())
+
+    # Deduplicate sources to avoid showing similar chunks
+    context_docs = deduplicate_sources(
+        context_docs, query_embedding=_dedup_query_embedding(query_embedding), k=_context_size()
+    )
+
+    prompt = build_prompt(query, context_docs)
+
+    # Use Hugging Face InferenceClient (from notebook)
+    llm = get_llm_client()
+    if not llm:
+        logger.error("LLM client not available")
+        return {"answer": "LLM not available. Please check backend logs.", "sources": []}
+
+    # Prompt the LLM (from notebook)
+    output = llm.chat_completion(
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=150
+    )
+
+    answer = format_answer(output.choices[0].message.content)
+    sources = format_sources(context_docs)
+
+    logger.info(f"Query processed successfully. Found {len(sources)} unique sources.")
+    response = {"answer": answer, "sources": sources}
+    if answer_cache:
+        answer_cache.put(query_embedding, response)
+    return response
+
+def answer_question(query: str, search_filter=None) -> dict:
+    """
+    Performs RAG on the given query using the same approach as the notebook.
+    Returns the answer and source documents. A semantically similar earlier
+    query is answered from the answer cache without calling the LLM.
+    search_filter restricts retrieval by source, page or ingestion date.
+    """
+    logger.info(f"Processing query: '{query}'")
+
+    try:
+        return _answer_with_embedding(query, get_query_embedding(query), search_filter)
+    except Exception as e:
+        logger.error(f"Error during RAG query: {e}", exc_info=True)
+        return {"answer": f"An error occurred: {e}. Please try again.", "sources": []}
+
+def answer_questions(queries, max_concurrency=BATCH_LLM_CONCURRENCY) -> list:
+    """
+    Batch counterpart of answer_question(). All queries are embedded in one
+    encode call, then retrieval and LLM calls run on at most max_concurrency
+    threads over the shared connection pool. Results are in input order; a
+    failed query yields {"query", "error"} instead of {"query", "answer", "sources"}.
+    """
+    logger.info(f"Processing batch of {len(queries)} queries")
+    embeddings = get_query_embeddings(queries)
+
+    def answer_one(query, query_embedding):
+        try:
+            return {"query": query, **_answer_with_embedding(query, query_embedding)}
+        except Exception as e:
+            logger.error(f"Error during batch RAG query '{query}': {e}")
+            return {"query": query, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        return list(pool.map(answer_one, queries, embeddings))
+
+async def _aanswer_with_embedding(query, query_embedding, llm_semaphore=None, search_filter=None):
+    """Async counterpart of _answer_with_embedding(); llm_semaphore caps concurrent LLM calls."""
+    answer_cache = None if search_filter else get_answer_cache()
+    if answer_cache:
+        cached = answer_cache.get(query_embedding)
+        if cached is not None:
+            return cached
+
+    retrieval_start = time.perf_counter()
+    context_docs = await aget_query_results(
+        query, query_embedding=query_embedding, limit=_retrieval_limit(), search_filter=search_filter
+    )
+    retrieval_ms = (time.perf_counter() - retrieval_start) * 1000
+    context_docs = await arerank_documents(query, context_docs, retrieval_ms, _mmr_candidates())
+    context_docs = deduplicate_sources(
+        context_docs, query_embedding=await _adedup_query_embedding(query_embedding), k=_context_size()
+    )
+    prompt = build_prompt(query, context_docs)
 
-        # Prompt the LLM (from notebook)
-        output = llm.chat_completion(
+    llm = get_async_llm_client()
+    if not llm:
+        logger.error("LLM client not available")
+        return {"answer": "LLM not available. Please check backend logs.", "sources": []}
+
+    async with llm_semaphore or contextlib.nullcontext():
+        output = await llm.chat_completion(
             messages=[{"role": "user", "content": prompt}],
             max_tokens=150
         )
 
-        # Format answer for readability (add newlines after colons if present)
-        answer = output.choices[0].message.content
-        if answer:
-            # Add a newline after each colon+space for better display
-            answer = answer.replace(': ', ':\n')
-
-        # Format sources with page number and link
-        sources = []
-        for doc in context_docs:
-            sources.append({
-                "page_content": doc["text"],
-                "metadata": {
-                    "source": "MongoDB Investor Relations PDF",
-                    "page_number": doc.get("page_number", None),
-                    "url": INVESTOR_PDF_URL
-                }
-            })
-
-        logger.info(f"Query processed successfully. Found {len(sources)} unique sources.")
-        return {"answer": answer, "sources": sources}
+    answer = format_answer(output.choices[0].message.content)
+    sources = format_sources(context_docs)
+
+    logger.info(f"Query processed successfully. Found {len(sources)} unique sources.")
+    response = {"answer": answer, "sources": sources}
+    if answer_cache:
+        answer_cache.put(query_embedding, response)
+    return response
 
+async def aanswer_question(query: str, search_filter=None) -> dict:
+    """
+    Async counterpart of answer_question(). Embedding runs on the bounded
+    embedding pool, retrieval uses the async Mongo driver and the LLM call uses
+    AsyncInferenceClient, so the event loop is never blocked.
+    """
+    logger.info(f"Processing query: '{query}'")
+
+    try:
+        return await _aanswer_with_embedding(query, await aget_query_embedding(query), search_filter=search_filter)
     except Exception as e:
         logger.error(f"Error during RAG query: {e}", exc_info=True)
         return {"answer": f"An error occurred: {e}. Please try again.", "sources": []}
 
+async def aanswer_questions(queries, max_concurrency=BATCH_LLM_CONCURRENCY) -> list:
+    """
+    Async counterpart of answer_questions(). Vector searches all run
+    concurrently over the shared pool; LLM calls are capped at max_concurrency.
+    """
+    logger.info(f"Processing batch of {len(queries)} queries")
+    embeddings = await aget_query_embeddings(queries)
+    llm_semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def answer_one(query, query_embedding):
+        try:
+            return {"query": query, **await _aanswer_with_embedding(query, query_embedding, llm_semaphore)}
+        except Exception as e:
+            logger.error(f"Error during batch RAG query '{query}': {e}")
+            return {"query": query, "error": str(e)}
+
+    return list(await asyncio.gather(*(answer_one(query, embedding) for query, embedding in zip(queries, embeddings))))
+
+async def astream_answer(query: str, search_filter=None):
+    """
+    Streaming variant of aanswer_question(). Yields (event, data) pairs: the
+    retrieved sources first, then formatted LLM tokens as they are generated,
+    then a final 'done' event with timings. Time to first token is recorded in
+    the 'time_to_first_token_ms' metric.
+    """
+    logger.info(f"Processing streaming query: '{query}'")
+    start = time.perf_counter()
+
+    try:
+        query_embedding = await aget_query_embedding(query)
+        answer_cache = None if search_filter else get_answer_cache()
+        cached = answer_cache.get(query_embedding) if answer_cache else None
+        if cached is not None:
+            yield "sources", cached["sources"]
+            yield "token", cached["answer"] or ""
+            yield "done", {"cached": True, "total_ms": (time.perf_counter() - start) * 1000}
+            return
+
+        retrieval_start = time.perf_counter()
+        context_docs = await aget_query_results(
+            query, query_embedding=query_embedding, limit=_retrieval_limit(), search_filter=search_filter
+        )
+        search_ms = (time.perf_counter() - retrieval_start) * 1000
+        context_docs = await arerank_documents(query, context_docs, search_ms, _mmr_candidates())
+        context_docs = deduplicate_sources(
+            context_docs, query_embedding=await _adedup_query_embedding(query_embedding), k=_context_size()
+        )
+        sources = format_sources(context_docs)
+        retrieval_ms = (time.perf_counter() - start) * 1000
+        yield "sources", sources
+
+        llm = get_async_llm_client()
+        if not llm:
+            logger.error("LLM client not available")
+            yield "error", "LLM not available. Please check backend logs."
+            return
+
+        stream = await llm.chat_completion(
+            messages=[{"role": "user", "content": build_prompt(query, context_docs)}],
+            max_tokens=150,
+            stream=True
+        )
+        formatter = AnswerFormatter()
+        answer_parts = []
+        first_token_ms = None
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if not token:
+                continue
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - start) * 1000
+                get_metric("time_to_first_token_ms").record(first_token_ms)
+            text = formatter.feed(token)
+            if text:
+                answer_parts.append(text)
+                yield "token", text
+        tail = formatter.flush()
+        if tail:
+            answer_parts.append(tail)
+            yield "token", tail
+
+        total_ms = (time.perf_counter() - start) * 1000
+        if answer_cache:
+            answer_cache.put(query_embedding, {"answer": "".join(answer_parts), "sources": sources})
+        yield "done", {"cached": False, "retrieval_ms": retrieval_ms, "time_to_first_token_ms": first_token_ms, "total_ms": total_ms}
+
+    except Exception as e:
+        logger.error(f"Error during streaming RAG query: {e}", exc_info=True)
+        yield "error", f"An error occurred: {e}. Please try again."
+
 if __name__ == "__main__":
     # Test the RAG chain
     logger.info("Testing RAG chain...")
@@ -1,8 +1,17 @@
 # RAG WITH ATLAS VECTOR SEARCH/backend/rag_models.py
+import asyncio
 import os
-from sentence_transformers import SentenceTransformer
-from huggingface_hub import InferenceClient
-from config import HF_MODEL_NAME
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+from config import HF_MODEL_NAME, EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL_NAME, EMBEDDING_MODEL_REVISION, EMBEDDING_EXECUTOR_WORKERS
+from config import EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_BACKEND, EMBEDDING_ONNX_FILE
+from config import EMBEDDING_MODEL_DIMENSIONS, RERANK_ENABLED, RERANK_MODEL_NAME
+from embedding_cache import get_embedding_cache, get_query_embedding_cache
+from metrics import get_metric
 import os
 import logging
 
@@ -10,64 +19,367 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 _embedding_model = None
+_reranker_model = None
 _llm_client = None
+_async_llm_client = None
+# One lock per model/client so concurrent first requests load each only once,
+# without a slow model load blocking creation of the others
+_embedding_model_lock = threading.Lock()
+_reranker_model_lock = threading.Lock()
+_llm_client_lock = threading.Lock()
+_async_llm_client_lock = threading.Lock()
+_embedding_batcher = None
+_embedding_batcher_lock = threading.Lock()
+_ingest_embedding_batcher = None
+
+# Bounded pool for CPU-bound embedding calls made from the async request path
+_embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_EXECUTOR_WORKERS, thread_name_prefix="embedding")
+
+class NomicEmbeddings:
+    """Wrapper around the SentenceTransformer model to make it compatible with LangChain."""
+    def __init__(self, model):
+        self.model = model
+
+    def embed_documents(self, texts, batch_size=EMBEDDING_BATCH_SIZE, progress_callback=None):
+        """
+        Generate embeddings for documents in batches.
+        Cached vectors are reused and only the remaining texts are encoded.
+        Returns a float32 array with one L2-normalized row per text, in input order.
+        progress_callback(done, total) is called after each batch.
+        """
+        total = len(texts)
+        embeddings = np.empty((total, EMBEDDING_MODEL_DIMENSIONS), dtype=np.float32)
+        cache = get_embedding_cache()
+        cached = cache.get_many(texts) if cache else [None] * total
+        missing = []
+        for i, vector in enumerate(cached):
+            if vector is None:
+                missing.append(i)
+            else:
+                embeddings[i] = vector
+        done = total - len(missing)
+        for start in range(0, len(missing), batch_size):
+            batch_ids = missing[start:start + batch_size]
+            batch_texts = [texts[i] for i in batch_ids]
+            batch = self.model.encode(batch_texts, batch_size=len(batch_ids), convert_to_numpy=True)
+            embeddings[batch_ids] = batch
+            if cache:
+                cache.put_many(batch_texts, batch)
+            done += len(batch_ids)
+            if progress_callback:
+                progress_callback(done, total)
+        # Unit vectors let the index use dotProduct and make cosine a plain dot product
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms == 0, 1, norms)
+        return embeddings
+
+    def embed_query(self, text):
+        """Generate embedding for a single query."""
+        return self.embed_documents([text])[0]
+
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx")
+
+def load_sentence_transformer(backend=EMBEDDING_BACKEND):
+    """
+    Loads the embedding model on CPU with the given inference backend:
+    'torch' (full-precision PyTorch), 'torch-int8' (dynamic int8 quantization of
+    the Linear layers) or 'onnx' (ONNX Runtime with EMBEDDING_ONNX_FILE).
+    """
+    # Imported here so importing this module does not pull in torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    if backend == "onnx":
+        return SentenceTransformer(
+            EMBEDDING_MODEL_NAME,
+            revision=EMBEDDING_MODEL_REVISION,
+            trust_remote_code=True,
+            backend="onnx",
+            model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+        )
+    # Load the embedding model exactly as in your notebook
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, revision=EMBEDDING_MODEL_REVISION, trust_remote_code=True)
+    if backend == "torch-int8":
+        import torch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
 
 def get_embedding_model():
     """Initializes and returns the nomic-ai/nomic-embed-text-v1 embedding model (from notebook)."""
     global _embedding_model
     if _embedding_model is None:
-        logger.info("Loading nomic-ai/nomic-embed-text-v1 embedding model...")
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                logger.info(f"Loading nomic-ai/nomic-embed-text-v1 embedding model ({EMBEDDING_BACKEND} backend)...")
+                try:
+                    _embedding_model = NomicEmbeddings(load_sentence_transformer(EMBEDDING_BACKEND))
+                    logger.info("Nomic embedding model loaded successfully.")
+                except Exception as e:
+                    logger.error(f"Error loading Nomic embedding model: {e}")
+                    _embedding_model = None
+    return _embedding_model
+
+def get_reranker_model():
+    """Initializes and returns the CPU cross-encoder used to rerank retrieved chunks."""
+    global _reranker_model
+    if _reranker_model is None:
+        with _reranker_model_lock:
+            if _reranker_model is None:
+                logger.info(f"Loading cross-encoder {RERANK_MODEL_NAME}...")
+                try:
+                    # Imported here so importing this module does not pull in torch
+                    from sentence_transformers import CrossEncoder
+                    _reranker_model = CrossEncoder(RERANK_MODEL_NAME, device="cpu")
+                    logger.info("Cross-encoder loaded successfully.")
+                except Exception as e:
+                    logger.error(f"Error loading cross-encoder {RERANK_MODEL_NAME}: {e}")
+                    _reranker_model = None
+    return _reranker_model
+
+class EmbeddingBatcher:
+    """
+    Micro-batching scheduler for concurrent embedding requests. Callers submit
+    single texts; a worker thread collects requests for up to window_ms (or
+    until max_batch_size is reached), runs one batched encode and resolves each
+    caller's future with its own vector. Batch sizes, queueing delay and encode
+    time are exported as metrics prefixed with name.
+    """
+    def __init__(self, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, name="embedding"):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher".replace("_", "-"), daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        """Queues a text and returns a concurrent.futures.Future for its embedding."""
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def submit_many(self, texts):
+        """Queues several texts and returns one future per text, in order."""
+        return [self.submit(text) for text in texts]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Past the window, still take requests that are already queued
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        started = time.monotonic()
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        for _, _, enqueued in batch:
+            get_metric(f"{self.name}_queue_delay_ms").record((started - enqueued) * 1000)
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        get_metric(f"{self.name}_batch_size").record(len(texts))
         try:
-            # Load the embedding model exactly as in your notebook
-            model = SentenceTransformer("nomic-ai/nomic-embed-text-v1", trust_remote_code=True)
-
-            # Create a wrapper class to make it compatible with LangChain
-            class NomicEmbeddings:
-                def __init__(self, model):
-                    self.model = model
-
-                def embed_documents(self, texts):
-                    """Generate embeddings for documents."""
-                    embeddings = self.model.encode(texts)
-                    return embeddings.tolist()
-
-                def embed_query(self, text):
-                    """Generate embedding for a single query."""
-                    embedding = self.model.encode([text])
-                    return embedding[0].tolist()
-
-            _embedding_model = NomicEmbeddings(model)
-            logger.info("Nomic embedding model loaded successfully.")
+            model = get_embedding_model()
+            if not model:
+                raise ValueError("Embedding model not available")
+            embeddings = dict(zip(texts, model.embed_documents(texts, batch_size=len(texts))))
         except Exception as e:
-            logger.error(f"Error loading Nomic embedding model: {e}")
-            _embedding_model = None
-    return _embedding_model
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        get_metric(f"{self.name}_batch_ms").record((time.monotonic() - started) * 1000)
+        for text, future, _ in batch:
+            future.set_result(embeddings[text])
+
+def get_embedding_batcher():
+    """Returns the process-wide embedding batcher, or None if EMBEDDING_BATCH_WINDOW_MS is 0."""
+    global _embedding_batcher
+    if EMBEDDING_BATCH_WINDOW_MS <= 0:
+        return None
+    if _embedding_batcher is None:
+        with _embedding_batcher_lock:
+            if _embedding_batcher is None:
+                _embedding_batcher = EmbeddingBatcher()
+    return _embedding_batcher
+
+def get_ingest_embedding_batcher():
+    """
+    Returns the batcher shared by concurrent ingestion pipelines. It is kept
+    apart from the query batcher so bulk ingestion does not queue ahead of
+    interactive queries, and fills batches of EMBEDDING_BATCH_SIZE chunks.
+    """
+    global _ingest_embedding_batcher
+    if _ingest_embedding_batcher is None:
+        with _embedding_batcher_lock:
+            if _ingest_embedding_batcher is None:
+                _ingest_embedding_batcher = EmbeddingBatcher(
+                    window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch_size=EMBEDDING_BATCH_SIZE, name="ingest_embedding"
+                )
+    return _ingest_embedding_batcher
 
 def get_llm_client():
     """Initializes and returns the Hugging Face InferenceClient (from notebook)."""
     global _llm_client
     if _llm_client is None:
-        logger.info(f"Loading Hugging Face LLM: {HF_MODEL_NAME}")
-        try:
-            _llm_client = InferenceClient(
-                HF_MODEL_NAME,
-                token=os.getenv("HUGGINGFACE_TOKEN")
-            )
-            logger.info(f"Hugging Face LLM '{HF_MODEL_NAME}' loaded successfully.")
-        except Exception as e:
-            logger.error(f"Error loading Hugging Face LLM '{HF_MODEL_NAME}': {e}")
-            _llm_client = None
+        with _llm_client_lock:
+            if _llm_client is None:
+                logger.info(f"Loading Hugging Face LLM: {HF_MODEL_NAME}")
+                try:
+                    _llm_client = InferenceClient(
+                        HF_MODEL_NAME,
+                        token=os.getenv("HUGGINGFACE_TOKEN")
+                    )
+                    logger.info(f"Hugging Face LLM '{HF_MODEL_NAME}' loaded successfully.")
+                except Exception as e:
+                    logger.error(f"Error loading Hugging Face LLM '{HF_MODEL_NAME}': {e}")
+                    _llm_client = None
     return _llm_client
 
+def get_async_llm_client():
+    """Initializes and returns the Hugging Face AsyncInferenceClient used by the async request path."""
+    global _async_llm_client
+    if _async_llm_client is None:
+        with _async_llm_client_lock:
+            if _async_llm_client is None:
+                try:
+                    _async_llm_client = AsyncInferenceClient(
+                        HF_MODEL_NAME,
+                        token=os.getenv("HUGGINGFACE_TOKEN")
+                    )
+                except Exception as e:
+                    logger.error(f"Error loading async Hugging Face LLM '{HF_MODEL_NAME}': {e}")
+                    _async_llm_client = None
+    return _async_llm_client
+
+def warm_up_models():
+    """
+    Loads the embedding model (and the cross-encoder, if reranking is enabled)
+    and LLM clients and runs one forward pass so the first request does not pay
+    for it. Returns the time taken in seconds.
+    """
+    start = time.perf_counter()
+    model = get_embedding_model()
+    if not model:
+        raise RuntimeError("Embedding model not available")
+    # Encode directly: the embedding caches would otherwise skip the forward pass
+    model.model.encode(["warm up"])
+    if RERANK_ENABLED:
+        reranker = get_reranker_model()
+        if reranker:
+            reranker.predict([("warm up", "warm up")])
+    get_llm_client()
+    get_async_llm_client()
+    elapsed = time.perf_counter() - start
+    get_metric("model_warmup_ms").record(elapsed * 1000)
+    logger.info(f"Models warmed up in {elapsed:.1f}s.")
+    return elapsed
+
 def get_embedding(data):
-    """Generates vector embeddings for the given data (from notebook)."""
+    """
+    Generates vector embeddings for the given data (from notebook). Concurrent
+    calls are coalesced into one batched encode by the embedding batcher.
+    """
+    batcher = get_embedding_batcher()
+    if batcher:
+        return batcher.submit(data).result()
+    model = get_embedding_model()
+    if model:
+        return model.embed_query(data)
+    else:
+        raise ValueError("Embedding model not available")
+
+def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, progress_callback=None):
+    """Generates vector embeddings for a list of texts in length-sorted batches."""
     model = get_embedding_model()
     if model:
-        embedding = model.model.encode(data)
-        return embedding.tolist()
+        return model.embed_documents(texts, batch_size=batch_size, progress_callback=progress_callback)
     else:
         raise ValueError("Embedding model not available")
 
+def get_ingest_embeddings(texts):
+    """
+    Embeds document chunks through the shared ingestion batcher, so pipelines
+    ingesting several documents at once share full model batches. Returns an
+    (n, 768) float32 array in input order.
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_MODEL_DIMENSIONS), dtype=np.float32)
+    futures = get_ingest_embedding_batcher().submit_many(texts)
+    return np.stack([future.result() for future in futures])
+
+def normalize_query(query):
+    """Normalizes a query for cache lookups: lowercased, whitespace collapsed."""
+    return " ".join(query.lower().split())
+
+def _embed_normalized_query(normalized):
+    """Embeds an already normalized query and stores it in the query embedding cache."""
+    # The model is uncased, so embedding the normalized text keeps hits and misses consistent
+    embedding = get_embedding(normalized)
+    cache = get_query_embedding_cache()
+    if cache:
+        cache.put(normalized, embedding)
+    return embedding
+
+def get_query_embedding(query):
+    """Embeds a search query, reusing the embedding of a recent identical (normalized) query."""
+    normalized = normalize_query(query)
+    cache = get_query_embedding_cache()
+    embedding = cache.get(normalized) if cache else None
+    if embedding is None:
+        embedding = _embed_normalized_query(normalized)
+    return embedding
+
+def get_query_embeddings(queries):
+    """
+    Embeds many search queries. Cached queries are reused and all remaining
+    (deduplicated) queries are embedded in a single encode call.
+    """
+    normalized = [normalize_query(query) for query in queries]
+    cache = get_query_embedding_cache()
+    embeddings = [cache.get(text) if cache else None for text in normalized]
+    missing = list(dict.fromkeys(text for text, embedding in zip(normalized, embeddings) if embedding is None))
+    if missing:
+        model = get_embedding_model()
+        if not model:
+            raise ValueError("Embedding model not available")
+        computed = dict(zip(missing, model.embed_documents(missing, batch_size=len(missing))))
+        if cache:
+            for text, embedding in computed.items():
+                cache.put(text, embedding)
+        embeddings = [computed[text] if embedding is None else embedding for text, embedding in zip(normalized, embeddings)]
+    return embeddings
+
+async def run_in_embedding_executor(func, *args):
+    """Runs a CPU-bound embedding call on the bounded embedding pool without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_embedding_executor, func, *args)
+
+async def aget_query_embedding(query):
+    """Async counterpart of get_query_embedding(); cache hits return without leaving the event loop."""
+    normalized = normalize_query(query)
+    cache = get_query_embedding_cache()
+    embedding = cache.get(normalized) if cache else None
+    if embedding is not None:
+        return embedding
+    batcher = get_embedding_batcher()
+    if batcher:
+        # Await the batcher's future directly; no executor thread is held while queued
+        embedding = await asyncio.wrap_future(batcher.submit(normalized))
+        if cache:
+            cache.put(normalized, embedding)
+        return embedding
+    return await run_in_embedding_executor(_embed_normalized_query, normalized)
+
+async def aget_query_embeddings(queries):
+    """Async counterpart of get_query_embeddings(), run on the bounded embedding pool."""
+    return await run_in_embedding_executor(get_query_embeddings, queries)
+
 if __name__ == "__main__":
     # Test model loading
     logger.info("Testing model loading...")
@@ -0,0 +1,169 @@
+# RAG WITH ATLAS VECTOR SEARCH/backend/semantic_cache.py
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL_SECONDS
+from config import DB_NAME, COLLECTION_NAME, CORPUS_VERSIONS_COLLECTION, ANSWER_CACHE_VERSION_CHECK_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+_version_watcher = None
+
+class SemanticAnswerCache:
+    """
+    Answer cache that matches new queries against earlier ones by embedding
+    similarity. Entries live in fixed slots of one normalized float32 matrix, so
+    a lookup is a single matrix-vector product. Expired entries are skipped and
+    the least recently used slot is reused when the cache is full.
+    """
+    def __init__(self, capacity, threshold, ttl_seconds=None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._vectors = None  # allocated on first put, once the dimension is known
+        self._responses = [None] * capacity
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._expires_at = np.full(capacity, np.inf)
+        self._last_used = np.zeros(capacity)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _live_mask(self, now):
+        return self._valid & (self._expires_at > now)
+
+    def get(self, embedding):
+        """Returns the stored response of the most similar earlier query above the threshold, or None."""
+        query = self._normalize(embedding)
+        with self._lock:
+            now = time.monotonic()
+            live = self._live_mask(now)
+            if self._vectors is None or not live.any():
+                self.misses += 1
+                return None
+            similarities = self._vectors @ query
+            similarities[~live] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            logger.info(f"Semantic answer cache hit (similarity {similarities[best]:.3f}).")
+            return self._responses[best]
+
+    def put(self, embedding, response):
+        """Stores a response for a query embedding, reusing an expired or the least recently used slot."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            now = time.monotonic()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(~self._live_mask(now))
+            slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._responses[slot] = response
+            self._valid[slot] = True
+            self._expires_at[slot] = now + self.ttl_seconds if self.ttl_seconds else np.inf
+            self._last_used[slot] = now
+
+    def invalidate(self):
+        """Drops every cached answer, e.g. after ingestion changed the corpus."""
+        with self._lock:
+            self._valid[:] = False
+            self._responses = [None] * self.capacity
+            self.invalidations += 1
+        logger.info("Semantic answer cache invalidated.")
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": int(self._live_mask(time.monotonic()).sum()),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+def _corpus_versions():
+    # Imported here: db_utils imports this module
+    from db_utils import get_mongo_client
+    return get_mongo_client()[DB_NAME][CORPUS_VERSIONS_COLLECTION]
+
+def get_corpus_version():
+    """The collection's current corpus version stamp, or None if it was never bumped."""
+    doc = _corpus_versions().find_one({"_id": COLLECTION_NAME}, {"version": 1})
+    return doc["version"] if doc else None
+
+def bump_corpus_version():
+    """Records that the corpus changed, so every worker drops its cached answers."""
+    _corpus_versions().update_one(
+        {"_id": COLLECTION_NAME},
+        {"$set": {"version": uuid.uuid4().hex, "updated_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True
+    )
+
+def _watch_corpus_version(cache, interval):
+    """Polls the corpus version and invalidates the cache when another process changed it."""
+    version = None
+    while True:
+        try:
+            current = get_corpus_version()
+            if version is not None and current != version:
+                cache.invalidate()
+            version = current
+        except Exception as e:
+            logger.warning(f"Error checking the corpus version: {e}")
+        time.sleep(interval)
+
+def get_answer_cache():
+    """
+    Returns the process-wide semantic answer cache, or None if its capacity is
+    0. Creating it starts the thread that watches the corpus version.
+    """
+    global _answer_cache, _version_watcher
+    if ANSWER_CACHE_SIZE <= 0:
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL_SECONDS)
+                _version_watcher = threading.Thread(
+                    target=_watch_corpus_version, args=(_answer_cache, ANSWER_CACHE_VERSION_CHECK_SECONDS),
+                    name="answer-cache-version", daemon=True
+                )
+                _version_watcher.start()
+    return _answer_cache
+
+def invalidate_answer_cache():
+    """
+    Invalidates this process's answer cache and bumps the corpus version, so
+    other workers (and processes such as the CLI ingest) follow within
+    ANSWER_CACHE_VERSION_CHECK_SECONDS. Blocks on MongoDB.
+    """
+    if _answer_cache is not None:
+        _answer_cache.invalidate()
+    try:
+        bump_corpus_version()
+    except Exception as e:
+        logger.error(f"Error bumping the corpus version; other workers keep their cached answers: {e}")